@@ -0,0 +1,4 @@
+#
+# Scripts for benchmarking MedType and other named entity recognition tools. Every script can be run as a
+# subcommand of the medtype-benchmarks command (see cli.py), or with `python -m medtype_benchmarks.<module>`.
+#
@@ -0,0 +1,5 @@
+# Allow `python -m medtype_benchmarks ...` to be used instead of the medtype-benchmarks command.
+
+from .cli import main
+
+main(prog_name='medtype-benchmarks')
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+#
+# Offline Node Normalization
+# The Node Normalization service (https://nodenormalization-sri.renci.org/) is built from the Babel compendia
+# (https://github.com/TranslatorSRI/Babel), which can be downloaded as JSONL files with one clique of equivalent
+# identifiers per line. This script builds a local SQLite index from those files, and BabelIndex looks up CURIEs
+# in it, returning results in the same shape as the get_normalized_nodes endpoint. This lets nodenorm.py and
+# pubmedds2pubannotator.py normalize terms without making any network requests.
+#
+# Differences from the online service:
+#   - 'type' only contains the clique's own Biolink type, not all of its ancestors.
+#   - CURIEs that aren't in the index are left out of the results rather than being mapped to null.
+#   - Conflation (e.g. of genes and proteins) is not supported.
+#
+import os
+
+import glob
+import gzip
+import click
+import json
+import logging
+import sqlite3
+
+logging.basicConfig(level=logging.INFO)
+
+# Insert this many cliques at a time while building the index.
+BATCH_SIZE = 100_000
+
+
+def open_compendium(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def read_clique(line):
+    """
+    Read a single clique from a Babel compendium line. Both the current format (identifiers as {'i': ..., 'l': ...})
+    and the older format ({'identifier': ..., 'label': ...}) are supported. Returns (type, identifiers,
+    preferred_name, information_content), where identifiers is a list of [curie, label] pairs with the preferred
+    identifier first.
+    """
+    clique = json.loads(line)
+    identifiers = []
+    for identifier in clique['identifiers']:
+        curie = identifier.get('i', identifier.get('identifier'))
+        label = identifier.get('l', identifier.get('label', ''))
+        identifiers.append([curie, label])
+
+    return clique.get('type'), identifiers, clique.get('preferred_name'), clique.get('ic')
+
+
+class BabelIndex:
+    """
+    A local index of Babel cliques that can be queried like the Node Normalization service.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise RuntimeError(f"Babel index {path} does not exist; build it with `babel_index.py build`")
+        self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+
+    def get_normalized_nodes(self, curies):
+        """ Look up CURIEs, returning the same structure as the Node Normalization get_normalized_nodes endpoint. """
+        results = {}
+        for curie in curies:
+            row = self.db.execute("""
+                SELECT cliques.type, cliques.identifiers, cliques.preferred_name, cliques.ic
+                FROM curies JOIN cliques ON curies.clique = cliques.id
+                WHERE curies.curie = ?
+                ORDER BY curies.clique
+                LIMIT 1
+            """, (curie,)).fetchone()
+            if row is None:
+                continue
+
+            (biolink_type, identifiers, preferred_name, ic) = row
+            equivalent_identifiers = []
+            for (identifier, label) in json.loads(identifiers):
+                equivalent = {'identifier': identifier}
+                if label:
+                    equivalent['label'] = label
+                equivalent_identifiers.append(equivalent)
+
+            preferred = dict(equivalent_identifiers[0])
+            if preferred_name:
+                preferred['label'] = preferred_name
+            elif 'label' not in preferred:
+                labels = [e['label'] for e in equivalent_identifiers if 'label' in e]
+                if labels:
+                    preferred['label'] = labels[0]
+
+            results[curie] = {
+                'id': preferred,
+                'equivalent_identifiers': equivalent_identifiers,
+                'type': [biolink_type] if biolink_type else []
+            }
+            if ic is not None:
+                results[curie]['information_content'] = float(ic)
+
+        return results
+
+
+def build_index(path, compendia):
+    """ Build a Babel index at path from a list of compendium files. """
+    if os.path.exists(path):
+        os.remove(path)
+
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE cliques (id INTEGER PRIMARY KEY, type TEXT, identifiers TEXT NOT NULL, preferred_name TEXT, ic REAL)")
+    db.execute("CREATE TABLE curies (curie TEXT NOT NULL, clique INTEGER NOT NULL)")
+
+    count_cliques = 0
+    count_curies = 0
+    for filename in compendia:
+        logging.info(f"Indexing {filename}")
+        cliques = []
+        curies = []
+        with open_compendium(filename) as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                (biolink_type, identifiers, preferred_name, ic) = read_clique(line)
+                if not identifiers:
+                    continue
+
+                count_cliques += 1
+                cliques.append((count_cliques, biolink_type, json.dumps(identifiers, separators=(',', ':')), preferred_name, ic))
+                curies.extend((curie, count_cliques) for (curie, _) in identifiers)
+
+                if len(cliques) >= BATCH_SIZE:
+                    db.executemany("INSERT INTO cliques VALUES (?, ?, ?, ?, ?)", cliques)
+                    db.executemany("INSERT INTO curies VALUES (?, ?)", curies)
+                    count_curies += len(curies)
+                    cliques = []
+                    curies = []
+
+        db.executemany("INSERT INTO cliques VALUES (?, ?, ?, ?, ?)", cliques)
+        db.executemany("INSERT INTO curies VALUES (?, ?)", curies)
+        count_curies += len(curies)
+        db.commit()
+
+    # Building the index after inserting everything is much faster than keeping it up to date while inserting.
+    logging.info(f"Indexing {count_curies} CURIEs in {count_cliques} cliques.")
+    db.execute("CREATE INDEX curies_by_curie ON curies (curie, clique)")
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+
+
+@click.group()
+def babel_index():
+    """
+    babel_index.py [command] -- build and query a local Node Normalization index.
+    """
+    pass
+
+
+@babel_index.command()
+@click.argument('index', type=click.Path(
+    file_okay=True,
+    dir_okay=False
+))
+@click.argument('compendia', nargs=-1, required=True, type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    exists=True
+))
+def build(index, compendia):
+    """
+    Build an index from Babel compendium files (or directories of them, optionally gzipped).
+    """
+    filenames = []
+    for compendium in compendia:
+        compendium_path = click.format_filename(compendium)
+        if os.path.isdir(compendium_path):
+            for pattern in ('*.txt', '*.jsonl', '*.txt.gz', '*.jsonl.gz'):
+                filenames.extend(sorted(glob.glob(os.path.join(compendium_path, '**', pattern), recursive=True)))
+        else:
+            filenames.append(compendium_path)
+
+    build_index(click.format_filename(index), filenames)
+
+
+@babel_index.command()
+@click.argument('index', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    exists=True
+))
+@click.argument('curie', nargs=-1)
+def lookup(index, curie):
+    """
+    Look up CURIEs in an index, printing the results as the Node Normalization service would.
+    """
+    print(json.dumps(BabelIndex(click.format_filename(index)).get_normalized_nodes(curie), indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    babel_index()
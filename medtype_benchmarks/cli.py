@@ -0,0 +1,65 @@
+#
+# The medtype-benchmarks command, which runs every benchmark script as a subcommand (e.g.
+# `medtype-benchmarks score ...` instead of `python scripts/score.py ...`).
+#
+# Subcommands are only imported when they are run, so a short invocation only pays for importing the modules (and
+# third-party libraries such as requests or numpy) that it actually uses.
+#
+
+import importlib
+
+import click
+
+# Subcommand name -> (module, click command in that module, short help).
+COMMANDS = {
+    'babel-index': ('babel_index', 'babel_index', 'Build and query a local Node Normalization index.'),
+    'cache': ('medtype_cache', 'medtype_cache', 'Inspect and prune a cache of MedType responses.'),
+    'combine': ('combine', 'combine', 'Combine the tracks of two PubAnnotator files.'),
+    'convert': ('pubmedds2pubannotator', 'convert', 'Convert a PubMedDS file into PubAnnotator.'),
+    'discovery': ('discovery', 'discovery', 'Find input files and manage manifests.'),
+    'filter': ('filter', 'filter', 'Filter a PubAnnotator file by PMID.'),
+    'load-test': ('load_test', 'load_test', 'Load test MedType servers and plan their capacity.'),
+    'merge': ('merge', 'merge', 'Merge several PubAnnotator files.'),
+    'nodenorm': ('nodenorm', 'nodenorm', 'Add a normalized copy of a track to a PubAnnotator file.'),
+    'pipeline': ('pipeline', 'pipeline', 'Convert, query, normalize and score in a single streaming run.'),
+    'pubtator2pubannotator': ('pubtator2pubannotator', 'pubtator2pubannotator', 'Convert a PubTator file into PubAnnotator.'),
+    'query-medtype': ('query_medtype', 'query_medtype', 'Annotate a PubAnnotator file with MedType.'),
+    'raw-archive': ('raw_archive', 'raw_archive', 'Convert and read archives of raw MedType outputs.'),
+    'reproject': ('reproject', 'reproject', 'Regenerate MedType tracks from stored raw MedType outputs.'),
+    'score': ('score', 'score', 'Score the tracks in PubAnnotator files against each other or a gold track.'),
+    'sharding': ('sharding', 'sharding', 'Check and consolidate the outputs of sharded runs.'),
+    'text-store': ('text_store', 'text_store', 'Convert between ordinary and annotation-only PubAnnotator files.'),
+}
+
+
+class LazyGroup(click.Group):
+    """ A click group that imports the module for a subcommand only when that subcommand is run. """
+
+    def list_commands(self, ctx):
+        return sorted(COMMANDS.keys())
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+
+        (module_name, command_name, _) = COMMANDS[name]
+        module = importlib.import_module(f'.{module_name}', __package__)
+        return getattr(module, command_name)
+
+    def format_commands(self, ctx, formatter):
+        # Use the short help from COMMANDS so that `medtype-benchmarks --help` doesn't import every subcommand.
+        rows = [(name, COMMANDS[name][2]) for name in self.list_commands(ctx)]
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
+def main():
+    """
+    Benchmark MedType and other named entity recognition tools on PubAnnotator files.
+    """
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+#
+# Combine PubAnnotator files
+# Given how large these files can be, by default we'll use the following algorithm:
+#   1. Identify the smaller of two input file.
+#   2. Go through the entries in the larger input file. For each entry, look for a matching entry
+#      in the other file. If found, combine and write out the output.
+# I will eventually add options for loading the entire input file into memory.
+#
+import os
+
+import click
+import json
+import logging
+
+from . import profiling
+from .pubannotator import Document
+from .text_store import TextStore, strip_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+
+def combine2(smaller_input, larger_input, output, texts=None):
+    with open(output, 'w') as fout:
+        with open(larger_input, 'r') as f:
+            for (index, line) in enumerate(f):
+                if line.strip() == '':
+                    continue
+                profiling.count('bytes_read', len(line))
+                entry = Document.from_line(line)
+                logging.debug(f"{larger_input} line {index}: {line}")
+
+                # Write the entry into the output file.
+                pmid = entry.pmid
+
+                # Look for this PMID in the other file. We only need to parse entries with a matching PMID.
+                flag_found_in_smaller = False
+                with open(smaller_input, 'r') as fsmall:
+                    for (index_smaller, line_smaller) in enumerate(fsmall):
+                        if line_smaller.strip() == '':
+                            continue
+                        profiling.count('bytes_read', len(line_smaller))
+                        entry_smaller = Document.from_line(line_smaller)
+
+                        # Read an entry from the smaller file.
+                        pmid_smaller = entry_smaller.pmid
+
+                        if pmid_smaller == pmid:
+                            logging.info(f"Found PMID {pmid} shared between input files, combining.")
+                            flag_found_in_smaller = True
+
+                            # Add new annotations from entry_smaller to entry.
+                            tracks = entry.tracks
+                            projects = set(tr.project for tr in tracks)
+                            for track_smaller in entry_smaller.tracks:
+                                project_smaller = track_smaller.project
+                                if project_smaller in projects:
+                                    logging.info(f"Track with project {project_smaller} found, skipping")
+                                else:
+                                    logging.info(f"Track with project {project_smaller} not found, adding.")
+                                    tracks.append(track_smaller)
+
+                logging.info(f"Completed checks for {pmid}, found = {flag_found_in_smaller}")
+
+                # Write to the output file.
+                with profiling.timer('serialize'):
+                    if texts is not None:
+                        content = json.dumps(strip_text(entry.to_dict(), pmid, texts))
+                    else:
+                        content = entry.to_json()
+                profiling.count('bytes_written', len(content) + 1)
+                profiling.count('documents')
+                fout.write(content)
+                fout.write("\n")
+
+@click.command()
+@profiling.profile_option
+@click.argument('input1', type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    readable=True,
+    allow_dash=False
+))
+@click.argument('input2', type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    readable=True,
+    allow_dash=False
+))
+@click.option('--output', '-O', default='-', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    writable=True,
+    allow_dash=True
+), help='Directory to write output files to')
+@text_store_option
+def combine(input1, input2, output, text_store):
+    """
+    Given a PubAnnotator input file and a track name, this script will create an additional track called
+    'track+NodeNorm' with original track node normalized.
+    """
+
+    input1_path = click.format_filename(input1)
+    input2_path = click.format_filename(input2)
+    output_path = click.format_filename(output)
+
+    # logging.info(f"Globbing: {f'{input_path}/**/*.jsonl'}.")
+
+    smaller_input = input1_path
+    larger_input = input2_path
+    if os.path.getsize(smaller_input) > os.path.getsize(larger_input):
+        smaller_input = input2_path
+        larger_input = input1_path
+
+    texts = TextStore(click.format_filename(text_store)) if text_store else None
+    combine2(smaller_input, larger_input, output_path, texts)
+
+
+if __name__ == '__main__':
+    combine()
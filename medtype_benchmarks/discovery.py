@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Fast discovery of input files in large directories.
+#
+# score.py, nodenorm.py and merge.py can be pointed at directories containing hundreds of thousands of per-PMID
+# JSONL files. Rather than walking these with a recursive glob on every run, find_files() walks the directory tree
+# with os.scandir() in several threads. Given --manifest DIR, it also saves what it finds in a manifest file in DIR
+# (e.g. DIR/outputs-<hash of its path>.jsonl-manifest.tsv for outputs/), listing the path, size, modification time
+# and PMID of every file. On later runs with the same --manifest, only directories whose modification time has
+# changed are listed again; everything else is read from the manifest. (DIR should be outside the input
+# directories, since writing a manifest into one would change its modification time.)
+#
+# Adding, removing or renaming a file (including the atomic renames our scripts use to write outputs) updates the
+# modification time of its directory, but rewriting a file in place does not: use --rescan after doing that.
+
+import logging
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import os
+import threading
+import time
+
+import click
+
+from .sharding import FILENAME_PMID
+
+logging.basicConfig(level=logging.INFO)
+
+MANIFEST_SUFFIX = '-manifest.tsv'
+MANIFEST_HEADER = '# medtype-benchmarks input manifest v1'
+
+# Number of directories to list at the same time.
+DEFAULT_WORKERS = 8
+
+# Directories modified this recently might be modified again within the resolution of their timestamp, so their
+# listings aren't reused on the next run.
+RACY_INTERVAL_NS = 2_000_000_000
+
+InputFile = collections.namedtuple('InputFile', ['path', 'size', 'mtime', 'pmid'])
+
+
+def discovery_options(f):
+    """ Add the --manifest and --rescan options to a click command. """
+    f = click.option('--rescan', is_flag=True, default=False, help='List every input directory again instead of trusting the manifest')(f)
+    f = click.option('--manifest', help='Save the files found in input directories to manifests in this directory and reuse them on later runs', type=click.Path(
+        file_okay=False,
+        dir_okay=True
+    ))(f)
+    return f
+
+
+def manifest_path(manifest_dir, path, suffix='.jsonl'):
+    """
+    The manifest of the files ending with suffix in a directory, kept in manifest_dir under the directory's name
+    and a hash of its absolute path. Different suffixes have different manifests, since each only lists the files
+    it was looking for.
+    """
+    path = os.path.abspath(path)
+    digest = hashlib.sha256(path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(manifest_dir, f'{os.path.basename(path)}-{digest}{suffix}{MANIFEST_SUFFIX}')
+
+
+def _list_directory(path, suffix):
+    """ List the files ending with suffix and the subdirectories in a directory, skipping hidden entries as glob does. """
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return files, subdirs
+
+
+def read_manifest(manifest_dir, path, suffix='.jsonl'):
+    """
+    Read a manifest, returning a dictionary of relative directory paths to (mtime, files), where files is a list
+    of (name, size, mtime) tuples. Returns an empty dictionary if the manifest doesn't exist or can't be read.
+    """
+    directories = {}
+    filename = manifest_path(manifest_dir, path, suffix)
+    if not os.path.exists(filename):
+        return directories
+
+    with open(filename, 'r') as f:
+        if f.readline().rstrip('\n') != MANIFEST_HEADER:
+            logging.warning(f"Ignoring manifest {filename} in an unknown format.")
+            return directories
+
+        try:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'D':
+                    directories[fields[1]] = (int(fields[2]), [])
+                elif fields[0] == 'F':
+                    (dirname, name) = os.path.split(fields[1])
+                    directories[dirname or '.'][1].append((name, int(fields[2]), int(fields[3])))
+        except (IndexError, KeyError, ValueError):
+            logging.warning(f"Ignoring damaged manifest {filename}.")
+            return {}
+
+    return directories
+
+
+def write_manifest(manifest_dir, path, directories, suffix='.jsonl'):
+    """ Write a manifest atomically; failing to write it (e.g. to a read-only directory) is not an error. """
+    filename = manifest_path(manifest_dir, path, suffix)
+    try:
+        os.makedirs(manifest_dir, exist_ok=True)
+        with open(filename + '.in-progress', 'w') as f:
+            f.write(MANIFEST_HEADER + '\n')
+            for reldir in sorted(directories.keys()):
+                (mtime, files) = directories[reldir]
+                f.write(f'D\t{reldir}\t{mtime}\n')
+                for (name, size, file_mtime) in files:
+                    relpath = name if reldir == '.' else os.path.join(reldir, name)
+                    m = FILENAME_PMID.match(name)
+                    f.write(f"F\t{relpath}\t{size}\t{file_mtime}\t{m.group(1) if m else ''}\n")
+        os.replace(filename + '.in-progress', filename)
+    except OSError as e:
+        logging.info(f"Could not write manifest {filename}, files will be listed again next time: {e}")
+
+
+def find_files(path, suffix='.jsonl', manifest=None, rescan=False, workers=DEFAULT_WORKERS):
+    """
+    Find every file ending with suffix in a directory and its subdirectories, returning a list of InputFiles sorted
+    by path. Given a manifest directory, directories that haven't changed since the last run aren't listed again.
+    """
+    previous = read_manifest(manifest, path, suffix) if manifest and not rescan else {}
+    children = collections.defaultdict(list)
+    for reldir in previous.keys():
+        if reldir != '.':
+            children[os.path.dirname(reldir) or '.'].append(os.path.basename(reldir))
+
+    counts = {'listed': 0, 'reused': 0}
+    lock = threading.Lock()
+
+    def visit(reldir):
+        full_path = path if reldir == '.' else os.path.join(path, reldir)
+        mtime = os.stat(full_path).st_mtime_ns
+        if reldir in previous and previous[reldir][0] == mtime:
+            (files, subdirs) = (previous[reldir][1], children.get(reldir, []))
+            count = 'reused'
+        else:
+            (files, subdirs) = _list_directory(full_path, suffix)
+            count = 'listed'
+        with lock:
+            counts[count] += 1
+
+        if time.time_ns() - mtime < RACY_INTERVAL_NS:
+            mtime = 0
+        return reldir, mtime, files, subdirs
+
+    directories = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(visit, '.')}
+        while pending:
+            (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (reldir, mtime, files, subdirs) = future.result()
+                directories[reldir] = (mtime, files)
+                for subdir in subdirs:
+                    pending.add(executor.submit(visit, subdir if reldir == '.' else os.path.join(reldir, subdir)))
+
+    if manifest and (counts['listed'] > 0 or len(directories) != len(previous)):
+        write_manifest(manifest, path, directories, suffix)
+
+    input_files = []
+    for (reldir, (mtime, files)) in directories.items():
+        for (name, size, file_mtime) in files:
+            m = FILENAME_PMID.match(name)
+            input_files.append(InputFile(
+                os.path.join(path, name) if reldir == '.' else os.path.join(path, reldir, name),
+                size,
+                file_mtime,
+                m.group(1) if m else None
+            ))
+    input_files.sort(key=lambda input_file: input_file.path)
+
+    logging.info(f"Found {len(input_files)} {suffix} files in {len(directories)} directories under {path} "
+                 f"({counts['listed']} directories listed, {counts['reused']} reused from manifest).")
+    return input_files
+
+
+def balance(input_files, count):
+    """
+    Split a list of files into count groups of roughly equal total size, by assigning the largest remaining file
+    to the smallest group. Files keep their original order within each group.
+    """
+    groups = [[] for _ in range(count)]
+    heap = [(0, index) for index in range(count)]
+    for (position, input_file) in sorted(enumerate(input_files), key=lambda t: -t[1].size):
+        (total, index) = heapq.heappop(heap)
+        groups[index].append((position, input_file))
+        heapq.heappush(heap, (total + input_file.size, index))
+
+    return [[input_file for (_, input_file) in sorted(group)] for group in groups]
+
+
+@click.group()
+def discovery():
+    """
+    discovery.py [command] -- find input files and manage manifests.
+    """
+    pass
+
+
+@discovery.command(name='list')
+@click.argument('input', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--suffix', help='Only list files ending with this suffix', default='.jsonl', show_default=True)
+@click.option('--groups', help='Split the files into this many groups of similar total size, printing the group of each file', default=0, type=click.IntRange(min=0), show_default=True)
+@discovery_options
+def list_files(input, suffix, groups, manifest, rescan):
+    """
+    List the input files in a directory (updating its manifest, with --manifest).
+    """
+    input_files = find_files(click.format_filename(input), suffix=suffix, manifest=manifest, rescan=rescan)
+    if groups:
+        for (index, group) in enumerate(balance(input_files, groups)):
+            for input_file in group:
+                print(f"{index}\t{input_file.path}")
+    else:
+        for input_file in input_files:
+            print(input_file.path)
+
+
+if __name__ == '__main__':
+    discovery()
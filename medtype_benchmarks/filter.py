@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+#
+# Filter a PubAnnotator file
+#
+
+import click
+import logging
+
+from . import profiling
+from .pubannotator import Document
+
+logging.basicConfig(level=logging.INFO)
+
+
+def filter_by_pmid_list(input, output, pmid_list: set):
+    with open(output, 'w') as fout:
+        with open(input, 'r') as f:
+            for (index, line) in enumerate(f):
+                if line.strip() == '':
+                    continue
+                # We only need the PMID, which can be read without parsing the whole entry.
+                profiling.count('bytes_read', len(line))
+                with profiling.timer('parse'):
+                    pmid = Document.from_line(line).pmid
+                logging.debug(f"{input} line {index}: PMID {pmid}")
+
+                # Look for this PMID in the pmid_list
+                if pmid in pmid_list:
+                    logging.info(f"Found PMID {pmid}")
+                    profiling.count('documents')
+                    profiling.count('bytes_written', len(line.rstrip('\n')) + 1)
+                    fout.write(line.rstrip('\n'))
+                    fout.write("\n")
+                else:
+                    logging.info(f"PMID {pmid} not found")
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    readable=True,
+    allow_dash=False
+))
+@click.option('--output', '-O', default='-', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    writable=True,
+    allow_dash=True
+), help='Directory to write output files to')
+@click.option('--pmid-list', type=click.File('r'))
+def filter(input, output, pmid_list):
+
+    input_path = click.format_filename(input)
+    output_path = click.format_filename(output)
+
+    # TODO: this could become a simple cat-tool as well (when run with no filters).
+    if pmid_list:
+        pmid_set = set()
+        for line in pmid_list:
+            pmid_set.add(line.strip())
+
+        logging.debug(f"Filtering to PMIDs: {pmid_set}")
+
+        filter_by_pmid_list(input_path, output_path, pmid_set)
+
+
+if __name__ == '__main__':
+    filter()
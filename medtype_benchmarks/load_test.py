@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+# Load testing and capacity planning for MedType servers.
+#
+# `load_test.py run` replays the texts of a PubAnnotator file against /run_linker at one or more concurrency levels
+# (optionally capped at a fixed request rate), and records the latency, text length and outcome of every request.
+# It then prints a capacity report: throughput, p50/p99 latency and error rate at each concurrency level, latency
+# by text length, and how many replicas and how much client concurrency are needed to reach a target throughput.
+#
+# `load_test.py stand-in` runs a stand-in for the MedType server that answers /run_linker requests with
+# MedType-shaped responses after a delay that grows with the length of the text, while handling a limited number of
+# requests at a time (like a server with a fixed number of cores). It can be used to try out the load tester,
+# query_medtype.py or the pipeline without a real MedType server; `run --stand-in` starts one in the background.
+
+import logging
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+import requests
+
+from . import profiling
+from .medtype_client import linker_request
+from .pubannotator import pmid_from_source_url
+from .text_store import TextStore, entry_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+# Concurrency levels to test if none are given.
+DEFAULT_CONCURRENCY = (1, 2, 4, 8, 16)
+
+# The number of text length buckets in the report. Buckets are quantiles of the corpus, so they hold similar
+# numbers of requests.
+LENGTH_BUCKETS = 4
+
+# A concurrency level counts as saturated once it reaches this fraction of the best throughput we measured.
+KNEE_FRACTION = 0.9
+
+# With --rate, a concurrency level has fallen behind its schedule if it started requests at less than this fraction
+# of the offered rate.
+SCHEDULE_FRACTION = 0.95
+
+
+def percentile(sorted_values, q):
+    """ The q-th percentile (0-100) of a sorted list, by the nearest-rank method, or None if the list is empty. """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def read_corpus(input, store=None, limit=0):
+    """ Read (pmid, text) pairs from a PubAnnotator file, skipping entries without any text. """
+    corpus = []
+    for line in input:
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        text = entry_text(entry, store)
+        if not text:
+            continue
+        try:
+            pmid = pmid_from_source_url(entry.get('source_url', ''))
+        except RuntimeError:
+            pmid = str(len(corpus))
+        corpus.append((pmid, text))
+        if limit and len(corpus) >= limit:
+            break
+    return corpus
+
+
+class Sample:
+    """
+    The outcome of a single request. With a request rate, latency is measured from the time the request was
+    scheduled to start, so it includes the lag (the time it waited for a free thread after that).
+    """
+    __slots__ = ('concurrency', 'pmid', 'chars', 'latency', 'error', 'sent', 'lag')
+
+    def __init__(self, concurrency, pmid, chars, latency, error, sent=0, lag=0):
+        self.concurrency = concurrency
+        self.pmid = pmid
+        self.chars = chars
+        self.latency = latency
+        self.error = error
+        self.sent = sent
+        self.lag = lag
+
+    def to_dict(self):
+        return {
+            'concurrency': self.concurrency,
+            'pmid': self.pmid,
+            'chars': self.chars,
+            'latency_ms': round(self.latency * 1000, 3),
+            'lag_ms': round(self.lag * 1000, 3),
+            'error': self.error
+        }
+
+
+def send(session, url, pmid, text, entity_linker, timeout):
+    """ Send a single request, returning (latency in seconds, error or None). """
+    profiling.count('requests')
+    started = time.perf_counter()
+    try:
+        with profiling.timer('network'):
+            response = session.post(url, json=linker_request(pmid, text, entity_linker), timeout=timeout)
+            if not response.ok:
+                return (time.perf_counter() - started, f'HTTP {response.status_code}')
+            if 'result' not in response.json():
+                return (time.perf_counter() - started, 'no result')
+    except (requests.RequestException, ValueError) as e:
+        return (time.perf_counter() - started, type(e).__name__)
+    return (time.perf_counter() - started, None)
+
+
+def run_level(session, urls, corpus, start, concurrency, count, duration, rate, warmup, entity_linker, timeout):
+    """
+    Send `warmup` + `count` requests (or as many as fit into `duration` seconds) from `concurrency` threads, taking
+    texts from the corpus in turn starting at `start`. If rate is set, requests are started on a fixed schedule of
+    `rate` requests per second, and only `concurrency` may be outstanding at once; latencies are then measured from
+    the scheduled start, so requests that had to wait for a thread include that wait. Returns the samples after
+    the warmup and the wall-clock time they took.
+    """
+    lock = threading.Lock()
+    samples = []
+    issued = 0
+    started = None
+    deadline = None
+
+    def next_request():
+        """ Claim the next request, returning (index, scheduled start), or None when the level is over. """
+        nonlocal issued, started, deadline
+        with lock:
+            if issued >= warmup + count:
+                return None
+            if issued == warmup:
+                started = time.perf_counter()
+                deadline = started + duration if duration else None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            index = issued
+            issued += 1
+        scheduled = started + (index - warmup) / rate if rate and started is not None else None
+        return (index, scheduled)
+
+    def work():
+        while True:
+            claimed = next_request()
+            if claimed is None:
+                return
+            (index, scheduled) = claimed
+            lag = 0
+            if scheduled is not None:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lag = -delay
+
+            (pmid, text) = corpus[(start + index) % len(corpus)]
+            url = urls[index % len(urls)]
+            sent = time.perf_counter()
+            (latency, error) = send(session, url, pmid, text, entity_linker, timeout)
+            if index >= warmup:
+                with lock:
+                    samples.append(Sample(concurrency, pmid, len(text), latency + lag, error, sent - started, lag))
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (samples, time.perf_counter() - (started or time.perf_counter()))
+
+
+def summarize(samples, elapsed, rate=0):
+    """
+    Summarize the samples of one concurrency level (or one text length bucket). Given the offered request rate,
+    also report the rate requests were actually started at and whether the level fell behind its schedule.
+    """
+    ok = sorted(s.latency for s in samples if s.error is None)
+    errors = len(samples) - len(ok)
+    summary = {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0,
+        'p50_ms': percentile(ok, 50) * 1000 if ok else None,
+        'p99_ms': percentile(ok, 99) * 1000 if ok else None,
+        'mean_ms': sum(ok) / len(ok) * 1000 if ok else None,
+    }
+    if elapsed is not None:
+        summary['elapsed'] = elapsed
+        summary['throughput'] = len(ok) / elapsed if elapsed > 0 else 0
+        summary['chars_per_second'] = sum(s.chars for s in samples if s.error is None) / elapsed if elapsed > 0 else 0
+    if rate and samples:
+        # On schedule, the last request is sent (requests - 1) / rate seconds after the first.
+        last_sent = max(s.sent for s in samples)
+        lags = sorted(s.lag for s in samples)
+        summary['offered_rate'] = rate
+        summary['achieved_rate'] = len(samples) / (last_sent + 1 / rate)
+        summary['lag_p99_ms'] = percentile(lags, 99) * 1000
+        summary['behind'] = summary['achieved_rate'] < SCHEDULE_FRACTION * rate
+    return summary
+
+
+def length_buckets(corpus, count=LENGTH_BUCKETS):
+    """ The upper bounds of `count` text length buckets, chosen from the quantiles of the corpus. """
+    lengths = sorted(len(text) for (_, text) in corpus)
+    bounds = sorted(set(percentile(lengths, 100 * (i + 1) / count) for i in range(count)))
+    bounds[-1] = math.inf
+    return bounds
+
+
+def capacity_plan(levels, replicas, max_error_rate, target_throughput):
+    """
+    Choose a client concurrency and replica count from the measured levels. The knee is the lowest concurrency
+    that reaches KNEE_FRACTION of the best throughput at an acceptable error rate: going beyond it mostly adds
+    latency. Returns None if no level had an acceptable error rate.
+    """
+    acceptable = [level for level in levels if level['error_rate'] <= max_error_rate and level['throughput'] > 0]
+    if not acceptable:
+        return None
+
+    best = max(acceptable, key=lambda level: level['throughput'])
+    knee = min((level for level in acceptable if level['throughput'] >= KNEE_FRACTION * best['throughput']),
+               key=lambda level: level['concurrency'])
+
+    plan = {
+        'best_concurrency': best['concurrency'],
+        'best_throughput': best['throughput'],
+        'knee_concurrency': knee['concurrency'],
+        'knee_throughput': knee['throughput'],
+        'knee_p99_ms': knee['p99_ms'],
+        # Throughput and concurrency per server, assuming requests were spread evenly across the --url servers.
+        'throughput_per_replica': knee['throughput'] / replicas,
+        'concurrency_per_replica': max(1, math.ceil(knee['concurrency'] / replicas)),
+    }
+    if target_throughput:
+        plan['target_throughput'] = target_throughput
+        plan['replicas_needed'] = math.ceil(target_throughput / plan['throughput_per_replica'])
+        plan['client_concurrency'] = plan['replicas_needed'] * plan['concurrency_per_replica']
+    return plan
+
+
+def format_ms(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+def print_report(levels, buckets, plan, corpus, urls, rate, max_error_rate, corpus_documents):
+    lengths = sorted(len(text) for (_, text) in corpus)
+    print(f"MedType capacity report for {', '.join(urls)}")
+    print(f" - Corpus: {len(corpus)} texts, median {percentile(lengths, 50)} characters, p99 {percentile(lengths, 99)} characters")
+    print(f" - Request rate: {f'{rate} requests/second' if rate else 'unlimited (closed loop)'}")
+    print()
+
+    print("Throughput and latency by concurrency" + (" (latency measured from the scheduled start):" if rate else ":"))
+    print(f"  {'concurrency':>11} {'requests':>8} {'req/s':>8} {'chars/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}"
+          + (f" {'sent/s':>8} {'lag p99':>9}" if rate else ''))
+    for level in levels:
+        line = (f"  {level['concurrency']:>11} {level['requests']:>8} {level['throughput']:>8.2f} {level['chars_per_second']:>10.0f} "
+                f"{format_ms(level['p50_ms']):>9} {format_ms(level['p99_ms']):>9} {level['error_rate']:>7.1%}")
+        if 'achieved_rate' in level:
+            line += f" {level['achieved_rate']:>8.2f} {format_ms(level['lag_p99_ms']):>9}" + ('  BEHIND' if level['behind'] else '')
+        print(line)
+    behind = [level['concurrency'] for level in levels if level.get('behind')]
+    if behind:
+        print(f" - Concurrency {', '.join(map(str, behind))} could not keep up with {rate} requests/second: requests "
+              f"waited for a free thread, and their latency includes that wait.")
+    print()
+
+    print("Latency by text length (p50 / p99 ms):")
+    bounds = [bucket['max_chars'] for bucket in buckets[levels[0]['concurrency']]] if levels else []
+    headers = [f'<= {b}' if b != math.inf else 'longer' for b in bounds]
+    print(f"  {'concurrency':>11} " + ' '.join(f'{h:>19}' for h in headers))
+    for level in levels:
+        cells = [f"{format_ms(b['p50_ms'])} / {format_ms(b['p99_ms'])}" for b in buckets[level['concurrency']]]
+        print(f"  {level['concurrency']:>11} " + ' '.join(f'{c:>19}' for c in cells))
+    print()
+
+    print("Capacity plan:")
+    if plan is None:
+        print(f" - No concurrency level had an error rate of at most {max_error_rate:.1%}; reduce the load or check the server.")
+        return
+
+    print(f" - Best throughput: {plan['best_throughput']:.2f} requests/second at concurrency {plan['best_concurrency']}")
+    print(f" - Knee: concurrency {plan['knee_concurrency']} reaches {plan['knee_throughput']:.2f} requests/second "
+          f"(p99 {format_ms(plan['knee_p99_ms'])} ms); more concurrency mostly adds latency")
+    if len(urls) > 1:
+        print(f" - Per replica ({len(urls)} tested): {plan['throughput_per_replica']:.2f} requests/second at concurrency {plan['concurrency_per_replica']}")
+    if 'replicas_needed' in plan:
+        print(f" - For {plan['target_throughput']} requests/second: {plan['replicas_needed']} replica(s), "
+              f"client --concurrency {plan['client_concurrency']}")
+    if corpus_documents:
+        hours = corpus_documents / plan['throughput_per_replica'] / 3600
+        print(f" - {corpus_documents} documents would take {hours:.1f} hours on one replica"
+              + (f", {hours / plan['replicas_needed']:.1f} hours on {plan['replicas_needed']}" if 'replicas_needed' in plan else ''))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Answers /run_linker requests like MedType, after a delay. The server provides the settings. """
+
+    # Capitalized words stand in for the mentions that MedType would find.
+    MENTION = re.compile('[A-Z][a-z]+')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # MedType doesn't serve anything here, but health checks only need a response.
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path.rstrip('/') != '/run_linker':
+            return self.reply(404, {'error': f'Unknown path {self.path}'})
+
+        text = body['data']['text'][0]
+        server = self.server
+        with server.slots:
+            time.sleep((server.base_latency + server.latency_per_kchar * len(text) / 1000) / 1000)
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.reply(500, {'error': 'Simulated failure'})
+
+        mentions = [{
+            'mention': m.group(0),
+            'start_offset': m.start(),
+            'end_offset': m.end(),
+            'pred_type': ['Disease_or_Syndrome'],
+            'filtered_candidates': [[f'C{zlib.crc32(m.group(0).encode()) % 10000000:07d}', 0.9]],
+        } for m in self.MENTION.finditer(text)]
+        self.reply(200, {
+            'id': body.get('id'),
+            'result': {
+                'elinks': [{'text': text, 'mentions': mentions}]
+            }
+        })
+
+    def reply(self, status, content):
+        encoded = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    A stand-in MedType server. Each request takes base_latency + latency_per_kchar for every thousand characters
+    of text (in milliseconds), and only `workers` requests are processed at once, so the server saturates like a
+    real one. A fraction error_rate of requests fail with HTTP 500.
+    """
+    daemon_threads = True
+    # Queue connections rather than refusing them when many clients connect at once.
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, workers=4, base_latency=50, latency_per_kchar=100, error_rate=0):
+        super().__init__((host, port), StandInHandler)
+        self.slots = threading.BoundedSemaphore(workers)
+        self.base_latency = base_latency
+        self.latency_per_kchar = latency_per_kchar
+        self.error_rate = error_rate
+
+    @property
+    def url(self):
+        (host, port) = self.server_address[:2]
+        return f'http://{host}:{port}/run_linker'
+
+    def start(self):
+        """ Serve requests in a background thread. """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def stand_in_options(f):
+    """ Options describing how a stand-in server behaves. """
+    f = click.option('--stand-in-workers', help='Number of requests the stand-in server processes at once', default=4, type=int, show_default=True)(f)
+    f = click.option('--stand-in-latency', help='Milliseconds the stand-in server takes for every request', default=50, type=float, show_default=True)(f)
+    f = click.option('--stand-in-latency-per-kchar', help='Additional milliseconds the stand-in server takes per 1000 characters of text', default=100, type=float, show_default=True)(f)
+    f = click.option('--stand-in-error-rate', help='Fraction of requests the stand-in server fails', default=0, type=float, show_default=True)(f)
+    return f
+
+
+@click.group()
+def load_test():
+    """
+    load_test.py [command] -- load test MedType servers and plan their capacity.
+    """
+    pass
+
+
+@load_test.command()
+@profiling.profile_option
+@click.argument('input', type=click.File('r'))
+@click.option('--url', help='URL of MedType server (repeat to spread requests evenly across several replicas)', default=['http://localhost:8125/run_linker'], multiple=True, type=str, show_default=True)
+@click.option('--stand-in', is_flag=True, default=False, help='Test a stand-in server started in the background instead of --url')
+@stand_in_options
+@click.option('--entity-linker', help='Entity linker to use', default='scispacy', type=str, show_default=True)
+@click.option('--concurrency', '-c', help='Concurrency level to test (repeat to test several)', default=DEFAULT_CONCURRENCY, multiple=True, type=int, show_default=True)
+@click.option('--rate', help='Start requests at this many per second (0 to send them as fast as the concurrency allows)', default=0, type=float, show_default=True)
+@click.option('--requests', 'request_count', help='Number of requests to measure at each concurrency level', default=200, type=int, show_default=True)
+@click.option('--duration', help='Stop each concurrency level after this many seconds (0 for no limit)', default=0, type=float, show_default=True)
+@click.option('--warmup', help='Number of requests to send at each concurrency level before measuring', default=5, type=int, show_default=True)
+@click.option('--timeout', help='Seconds to wait for each response', default=300, type=float, show_default=True)
+@click.option('--limit', help='Read at most this many texts from the input (0 for all of them)', default=1000, type=int, show_default=True)
+@click.option('--max-error-rate', help='Highest error rate at which a concurrency level is still usable', default=0.01, type=float, show_default=True)
+@click.option('--target-throughput', help='Requests per second the capacity plan should reach', type=float)
+@click.option('--corpus-documents', help='Number of documents in the full corpus, to estimate how long annotating it would take', type=int)
+@click.option('--samples', help='Write every request (concurrency, PMID, characters, latency, lag, error) to this JSONL file', type=click.File('w'))
+@click.option('--report', help='Write the report as JSON to this file', type=click.File('w'))
+@text_store_option
+def run(input, url, stand_in, stand_in_workers, stand_in_latency, stand_in_latency_per_kchar, stand_in_error_rate,
+        entity_linker, concurrency, rate, request_count, duration, warmup, timeout, limit, max_error_rate,
+        target_throughput, corpus_documents, samples, report, text_store):
+    """
+    Replay the texts of a PubAnnotator file against MedType at several concurrency levels and print a capacity report.
+    """
+    store = TextStore(click.format_filename(text_store)) if text_store else None
+    corpus = read_corpus(input, store, limit)
+    if not corpus:
+        raise click.ClickException("No texts found in the input file")
+    logging.info(f"Read {len(corpus)} texts from {input.name}")
+
+    if stand_in:
+        server = StandInServer(workers=stand_in_workers, base_latency=stand_in_latency,
+                               latency_per_kchar=stand_in_latency_per_kchar, error_rate=stand_in_error_rate).start()
+        urls = [server.url]
+        logging.info(f"Started a stand-in MedType server at {server.url}")
+    else:
+        urls = list(url)
+
+    # Don't let the connection pool queue requests, and don't retry them: we want to see every failure.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(concurrency), max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    bounds = length_buckets(corpus)
+    levels = []
+    buckets = {}
+    start = 0
+    for level_concurrency in concurrency:
+        logging.info(f"Testing concurrency {level_concurrency} with {request_count} requests"
+                     + (f" at {rate} requests/second" if rate else ''))
+        (level_samples, elapsed) = run_level(session, urls, corpus, start, level_concurrency, request_count, duration,
+                                             rate, warmup, entity_linker, timeout)
+        start += warmup + len(level_samples)
+
+        level = summarize(level_samples, elapsed, rate)
+        level['concurrency'] = level_concurrency
+        levels.append(level)
+        logging.info(f"Concurrency {level_concurrency}: {level['throughput']:.2f} requests/second, "
+                     f"p50 {format_ms(level['p50_ms'])} ms, p99 {format_ms(level['p99_ms'])} ms, {level['errors']} errors")
+        if level.get('behind'):
+            logging.warning(f"Concurrency {level_concurrency} fell behind its schedule: sent {level['achieved_rate']:.2f} "
+                            f"of {rate} requests/second")
+
+        buckets[level_concurrency] = []
+        lower = 0
+        for upper in bounds:
+            bucket = summarize([s for s in level_samples if lower < s.chars <= upper], None)
+            bucket['max_chars'] = upper
+            buckets[level_concurrency].append(bucket)
+            lower = upper
+
+        if samples:
+            for sample in level_samples:
+                samples.write(json.dumps(sample.to_dict()) + '\n')
+
+    plan = capacity_plan(levels, len(urls), max_error_rate, target_throughput)
+    print_report(levels, buckets, plan, corpus, urls, rate, max_error_rate, corpus_documents)
+
+    if report:
+        json.dump({
+            'urls': urls,
+            'rate': rate,
+            'corpus_texts': len(corpus),
+            'levels': levels,
+            'length_buckets': {str(c): [dict(b, max_chars=None if b['max_chars'] == math.inf else b['max_chars']) for b in bs]
+                               for (c, bs) in buckets.items()},
+            'plan': plan
+        }, report, indent=4)
+
+
+@load_test.command(name='stand-in')
+@click.option('--host', help='Address to listen on', default='127.0.0.1', type=str, show_default=True)
+@click.option('--port', help='Port to listen on', default=8125, type=int, show_default=True)
+@click.option('--workers', help='Number of requests to process at once', default=4, type=int, show_default=True)
+@click.option('--latency', help='Milliseconds taken by every request', default=50, type=float, show_default=True)
+@click.option('--latency-per-kchar', help='Additional milliseconds taken per 1000 characters of text', default=100, type=float, show_default=True)
+@click.option('--error-rate', help='Fraction of requests to fail with HTTP 500', default=0, type=float, show_default=True)
+def stand_in(host, port, workers, latency, latency_per_kchar, error_rate):
+    """
+    Run a stand-in MedType server that answers /run_linker requests with made-up annotations.
+    """
+    server = StandInServer(host, port, workers=workers, base_latency=latency, latency_per_kchar=latency_per_kchar,
+                           error_rate=error_rate)
+    logging.info(f"Stand-in MedType server listening at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    load_test()
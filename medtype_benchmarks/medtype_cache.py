@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# A persistent, content-addressed cache of MedType responses.
+#
+# Responses are keyed by a hash of the text sent to MedType, the entity linker and the version of the MedType
+# server, so the same text is only ever sent to MedType once, no matter which output directory, split or project
+# it is being processed for. Each response is stored minified and gzipped as <cache>/<first two hex digits>/<key>.json.gz.
+# Reading a response updates its modification time, so that eviction can remove the least recently used responses
+# first once the cache grows beyond its maximum size.
+
+import logging
+import json
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+
+import click
+
+logging.basicConfig(level=logging.INFO)
+
+# The version of the MedType server we are currently running (see kubernetes/medtype-server.k8s.yaml).
+DEFAULT_SERVER_VERSION = 'medtype-server:1.1'
+
+# When evicting, remove responses until the cache is this fraction of its maximum size.
+EVICTION_TARGET = 0.9
+
+
+def parse_size(size):
+    """ Parse a size such as '500M' or '20G' into a number of bytes. """
+    m = re.match('^(\\d+(?:\\.\\d+)?)\\s*([KMGT]?)B?$', str(size).strip(), re.IGNORECASE)
+    if not m:
+        raise click.BadParameter(f"Could not parse size '{size}', expected something like '500M' or '20G'")
+    multiplier = 1024 ** ' KMGT'.index(m.group(2).upper() or ' ')
+    return int(float(m.group(1)) * multiplier)
+
+
+class ResponseCache:
+    """
+    A directory of MedType responses, keyed by a hash of (text, entity linker, server version).
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        # We only need to keep track of the total size if we might need to evict responses.
+        self.total_size = sum(size for (_, size, _) in self.entries()) if max_size else 0
+
+    @staticmethod
+    def key(text, entity_linker, server_version=DEFAULT_SERVER_VERSION):
+        content = json.dumps([text, entity_linker, server_version], separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.json.gz')
+
+    def get(self, key):
+        """ Return the cached response for this key, or None if it hasn't been cached. """
+        path = self._path_for(key)
+        try:
+            with gzip.open(path, 'rt') as f:
+                response = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        # Mark this response as recently used. Another thread may have evicted it since we read it, but we still
+        # have the response, so that's still a cache hit.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return response
+
+    def put(self, key, response):
+        """ Add a response to the cache, evicting old responses if the cache is too large. """
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = gzip.compress(json.dumps(response, separators=(',', ':')).encode('utf-8'))
+        replaced_size = os.path.getsize(path) if self.max_size and os.path.exists(path) else 0
+        in_progress_path = f'{path}.{os.getpid()}.{threading.get_ident()}.in-progress'
+        with open(in_progress_path, 'wb') as f:
+            f.write(data)
+        os.replace(in_progress_path, path)
+
+        if self.max_size:
+            with self.lock:
+                self.total_size += len(data) - replaced_size
+                if self.total_size > self.max_size:
+                    self.total_size = self.prune(max_size=int(self.max_size * EVICTION_TARGET))
+
+    def entries(self):
+        """ Yield (path, size, mtime) for every response in the cache. """
+        for prefix in os.scandir(self.path):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith('.json.gz'):
+                    stat = entry.stat()
+                    yield (entry.path, stat.st_size, stat.st_mtime)
+
+    def prune(self, max_size=None, max_age=None):
+        """
+        Remove responses that haven't been used in max_age seconds, and then the least recently used responses
+        until the cache is no larger than max_size bytes. Returns the size of the cache afterwards.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total_size = sum(size for (_, size, _) in entries)
+        oldest_allowed = time.time() - max_age if max_age else None
+
+        count_removed = 0
+        for (path, size, mtime) in entries:
+            too_old = oldest_allowed is not None and mtime < oldest_allowed
+            too_big = max_size is not None and total_size > max_size
+            if not too_old and not too_big:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            count_removed += 1
+
+        logging.info(f"Removed {count_removed} responses from MedType cache {self.path} ({total_size} bytes remaining).")
+        return total_size
+
+
+def cached_run_linker(cache, server_version, run_linker):
+    """
+    Wrap a run_linker(session, url, pmid, text, entity_linker) function so that it consults the cache before
+    querying MedType, and caches every successful response.
+    """
+    def run_linker_with_cache(session, url, pmid, text, entity_linker):
+        key = ResponseCache.key(text, entity_linker, server_version)
+        response = cache.get(key)
+        if response is not None:
+            logging.debug(f"Found cached MedType response for PMID {pmid} ({key}).")
+            return response
+
+        response = run_linker(session, url, pmid, text, entity_linker)
+        if response is not None:
+            cache.put(key, response)
+        return response
+
+    return run_linker_with_cache
+
+
+@click.group()
+def medtype_cache():
+    """
+    medtype_cache.py [command] -- inspect and prune the MedType response cache.
+    """
+    pass
+
+
+@medtype_cache.command()
+@click.argument('cache', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+def inspect(cache):
+    """
+    Summarize the responses in a MedType cache.
+    """
+    entries = list(ResponseCache(click.format_filename(cache)).entries())
+    print(f"MedType cache {cache}:")
+    print(f" - Responses: {len(entries)}")
+    print(f" - Total size: {sum(size for (_, size, _) in entries)} bytes")
+    if entries:
+        mtimes = [mtime for (_, _, mtime) in entries]
+        print(f" - Least recently used: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(min(mtimes)))}")
+        print(f" - Most recently used: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(max(mtimes)))}")
+
+
+@medtype_cache.command()
+@click.argument('cache', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--max-size', help='Remove least recently used responses until the cache is no larger than this (e.g. 500M, 20G)', type=str)
+@click.option('--max-age-days', help='Remove responses that have not been used in this many days', type=float)
+def prune(cache, max_size, max_age_days):
+    """
+    Remove old responses from a MedType cache.
+    """
+    ResponseCache(click.format_filename(cache)).prune(
+        max_size=parse_size(max_size) if max_size else None,
+        max_age=max_age_days * 24 * 60 * 60 if max_age_days else None
+    )
+
+
+if __name__ == '__main__':
+    medtype_cache()
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+
+# Functions for sending texts to a MedType server.
+#
+# Long texts (such as full-text PMC articles) can be split into chunks that are sent to MedType concurrently.
+# Chunks end at sentence boundaries wherever possible; sentences that are too long by themselves are split into
+# overlapping windows. Mention offsets are remapped back into document coordinates and mentions that were seen
+# in two overlapping windows are de-duplicated, so the merged response looks like a response for the whole text.
+#
+# Requests can also be spread across several MedType replicas with an EndpointPool, which sends each request to
+# the healthy replica with the fewest outstanding requests, and drains replicas that keep failing until a health
+# check shows that they have recovered.
+
+import logging
+import json
+import re
+import socket
+import threading
+import time
+import urllib.parse
+
+import requests
+
+from . import profiling
+
+# A sentence ends with a full stop, question mark or exclamation mark, optionally followed by closing quotes or
+# brackets, and then whitespace.
+SENTENCE_END = re.compile('[.!?][\'")\\]]*\\s+')
+
+# Status codes that mean a server (or the proxy in front of it) is unavailable, rather than that it couldn't handle
+# a particular request.
+UNAVAILABLE_STATUS_CODES = (502, 503, 504)
+
+# Number of times to retry a request that the server failed with some other server error (such as a 500 from
+# MedType choking on a particular text), which is more likely to be a problem with the text than with the server.
+DOCUMENT_ERROR_RETRIES = 1
+
+# Without health checks, a drained endpoint is tried again after this many seconds, doubling every time it is
+# drained again without a request succeeding in between, up to MAX_DRAIN_BACKOFF.
+DRAIN_BACKOFF = 10
+MAX_DRAIN_BACKOFF = 300
+
+
+def linker_request(pmid, text, entity_linker):
+    """ The JSON body of a /run_linker request. """
+    return {
+        'id': f'PMID:{pmid}',
+        'data': {
+            'text': [text],
+            'entity_linker': entity_linker
+        }
+    }
+
+
+def run_linker(session, url, pmid, text, entity_linker):
+    """
+    Send a text to the MedType server and return the parsed response, or None if the request failed.
+    """
+    profiling.count('requests')
+    with profiling.timer('network'):
+        response = session.post(url, json=linker_request(pmid, text, entity_linker))
+    if not response.ok:
+        logging.error(f"MedType returned an error for PMID {pmid}: {response}")
+        return None
+
+    return response.json()
+
+
+def split_windows(text, start, end, max_chars, overlap):
+    """
+    Split text[start:end] into windows of at most max_chars characters that overlap by `overlap` characters,
+    breaking at whitespace where we can. Returns a list of (begin, end) pairs.
+    """
+    windows = []
+    while True:
+        stop = min(start + max_chars, end)
+        if stop < end:
+            # Break after the last whitespace in the window, as long as that still lets us make progress.
+            whitespace = max(text.rfind(' ', start + overlap + 1, stop), text.rfind('\n', start + overlap + 1, stop))
+            if whitespace > start:
+                stop = whitespace + 1
+        windows.append((start, stop))
+
+        if stop >= end:
+            return windows
+        start = stop - overlap
+
+
+def split_text(text, max_chars, overlap=0):
+    """
+    Split a text into chunks of at most max_chars characters, returned as a list of (offset, chunk) pairs.
+
+    Consecutive sentences are packed into the same chunk for as long as they fit. Sentences longer than max_chars
+    are split into windows overlapping by `overlap` characters, so that mentions cut off at the end of one window
+    can be found in full in the next one.
+    """
+    if overlap * 2 >= max_chars:
+        raise RuntimeError(f"Chunk overlap ({overlap}) must be less than half the maximum chunk size ({max_chars})")
+
+    if len(text) <= max_chars:
+        return [(0, text)]
+
+    sentence_starts = [0] + [m.end() for m in SENTENCE_END.finditer(text)]
+    sentence_ends = sentence_starts[1:] + [len(text)]
+
+    spans = []
+    chunk_start = None
+    chunk_end = None
+    for (start, end) in zip(sentence_starts, sentence_ends):
+        if start == end:
+            continue
+
+        if chunk_start is not None and end - chunk_start <= max_chars:
+            chunk_end = end
+            continue
+
+        if chunk_start is not None:
+            spans.append((chunk_start, chunk_end))
+            chunk_start = None
+
+        if end - start > max_chars:
+            spans.extend(split_windows(text, start, end, max_chars, overlap))
+        else:
+            chunk_start = start
+            chunk_end = end
+
+    if chunk_start is not None:
+        spans.append((chunk_start, chunk_end))
+
+    return [(start, text[start:end]) for (start, end) in spans]
+
+
+def dedupe_mentions(chunks, mentions_by_chunk):
+    """
+    Given mentions (already in document coordinates) for each chunk, drop mentions that were found in the
+    region shared by two overlapping chunks. Where two mentions from adjacent chunks overlap, we keep the one
+    further away from the edge of its chunk, since the other one may have been cut off.
+    """
+    dropped = set()
+    for index in range(len(chunks) - 1):
+        overlap_begin = chunks[index + 1][0]
+        overlap_end = chunks[index][0] + len(chunks[index][1])
+        if overlap_begin >= overlap_end:
+            continue
+
+        left = [m for m in mentions_by_chunk[index] if m['end_offset'] > overlap_begin]
+        right = [m for m in mentions_by_chunk[index + 1] if m['start_offset'] < overlap_end]
+        for ml in left:
+            for mr in right:
+                if id(ml) in dropped or id(mr) in dropped:
+                    continue
+                if ml['start_offset'] >= mr['end_offset'] or mr['start_offset'] >= ml['end_offset']:
+                    continue
+
+                if overlap_end - ml['end_offset'] > mr['start_offset'] - overlap_begin:
+                    dropped.add(id(mr))
+                else:
+                    dropped.add(id(ml))
+
+    mentions = [m for ms in mentions_by_chunk for m in ms if id(m) not in dropped]
+    return sorted(mentions, key=lambda m: (m['start_offset'], m['end_offset']))
+
+
+def merge_chunk_results(pmid, text, chunks, results):
+    """
+    Merge the MedType responses for each chunk of a text into a single response for the entire text.
+    """
+    template = None
+    mentions_by_chunk = []
+    for ((offset, chunk), result) in zip(chunks, results):
+        elinks = result['result']['elinks']
+        if len(elinks) > 1:
+            raise RuntimeError(f"Too many results ('elinks') found for a chunk of PMID {pmid} at offset {offset}")
+
+        mentions = []
+        if elinks:
+            template = template or elinks[0]
+            for mention in elinks[0]['mentions']:
+                m = dict(mention)
+                m['start_offset'] += offset
+                m['end_offset'] += offset
+                mentions.append(m)
+        mentions_by_chunk.append(mentions)
+
+    merged = dict(results[0])
+    merged['result'] = dict(results[0]['result'])
+    merged['result']['elinks'] = []
+    if template is not None:
+        elink = dict(template)
+        if 'text' in elink:
+            elink['text'] = text
+        elink['mentions'] = dedupe_mentions(chunks, mentions_by_chunk)
+        merged['result']['elinks'].append(elink)
+
+    # Record how the text was chunked, in case we need to debug the merged offsets.
+    merged['chunks'] = [{'begin': offset, 'end': offset + len(chunk)} for (offset, chunk) in chunks]
+    return merged
+
+
+def query_text(session, url, pmid, text, entity_linker, max_chunk_size=0, chunk_overlap=0, executor=None, linker=run_linker):
+    """
+    Send a text to MedType, splitting it into chunks of at most max_chunk_size characters (if set) that are
+    sent concurrently on the given executor. Each text or chunk is sent with `linker`, which has the same
+    signature as run_linker(). Returns a single response for the whole text, or None if any of the requests failed.
+    """
+    if not max_chunk_size or len(text) <= max_chunk_size:
+        return linker(session, url, pmid, text, entity_linker)
+
+    chunks = split_text(text, max_chunk_size, chunk_overlap)
+    logging.info(f"Split PMID {pmid} ({len(text)} characters) into {len(chunks)} chunks.")
+
+    def run_chunk(chunk):
+        return linker(session, url, pmid, chunk[1], entity_linker)
+
+    if executor is None:
+        results = list(map(run_chunk, chunks))
+    else:
+        results = list(executor.map(run_chunk, chunks))
+
+    if any(result is None for result in results):
+        logging.error(f"Could not annotate all {len(chunks)} chunks of PMID {pmid}.")
+        return None
+
+    return merge_chunk_results(pmid, text, chunks, results)
+
+
+class Projection:
+    """
+    Rules for converting a MedType response into a PubAnnotator track:
+      - project: the project name of the track.
+      - candidate_field: the list of candidates in each mention to take link_ids from.
+      - max_candidates: keep at most this many candidates for each mention (0 to keep them all).
+      - min_score: drop candidates scored lower than this ([id, score] candidates only).
+      - types: only keep mentions with at least one of these predicted types.
+      - exclude_types: drop mentions with any of these predicted types.
+      - drop_unlinked: drop mentions that have no candidates left.
+    """
+
+    FIELDS = ('project', 'candidate_field', 'max_candidates', 'min_score', 'types', 'exclude_types', 'drop_unlinked')
+
+    def __init__(self, project, candidate_field='filtered_candidates', max_candidates=0, min_score=None, types=None,
+                 exclude_types=None, drop_unlinked=False):
+        self.project = project
+        self.candidate_field = candidate_field
+        self.max_candidates = max_candidates
+        self.min_score = min_score
+        self.types = set(types) if types else None
+        self.exclude_types = set(exclude_types) if exclude_types else None
+        self.drop_unlinked = drop_unlinked
+
+    @classmethod
+    def from_dict(cls, d):
+        unknown = set(d.keys()) - set(cls.FIELDS)
+        if unknown:
+            raise RuntimeError(f"Unknown projection settings {sorted(unknown)}, expected some of: {list(cls.FIELDS)}")
+        if 'project' not in d:
+            raise RuntimeError(f"Projection {d} has no project name")
+        return cls(**d)
+
+    def candidates(self, mention):
+        candidates = mention.get(self.candidate_field) or []
+        if self.min_score is not None:
+            candidates = [c for c in candidates if not isinstance(c, list) or len(c) < 2 or c[1] >= self.min_score]
+        if self.max_candidates:
+            candidates = candidates[:self.max_candidates]
+        return [c[0] if isinstance(c, list) else c for c in candidates]
+
+    def track(self, pmid, result):
+        """
+        Convert a MedType response into a PubAnnotator track, or None if MedType didn't return any results.
+        """
+        elinks = result['result']['elinks']
+        if len(elinks) == 0:
+            return None
+        elif len(elinks) > 1:
+            raise RuntimeError(f"Too many results ('elinks') found for PMID {pmid}: {json.dumps(elinks, indent=4, sort_keys=True)}")
+
+        denotations = []
+        for mention in elinks[0]['mentions']:
+            pred_type = mention['pred_type']
+            if self.types is not None and not self.types.intersection(pred_type):
+                continue
+            if self.exclude_types is not None and self.exclude_types.intersection(pred_type):
+                continue
+
+            link_ids = self.candidates(mention)
+            if self.drop_unlinked and not link_ids:
+                continue
+
+            denotations.append({
+                'id': f"D{len(denotations) + 1}",
+                'link_ids': link_ids,
+                'obj': pred_type,
+                'span': {
+                    'begin': mention['start_offset'],
+                    'end': mention['end_offset']
+                },
+                'text': mention['mention']
+            })
+
+        return {
+            'project': self.project,
+            'denotations': denotations
+        }
+
+
+def result_to_track(pmid, result, project):
+    """
+    Convert a MedType response into a PubAnnotator track, or None if MedType didn't return any results.
+    """
+    return Projection(project).track(pmid, result)
+
+
+class Endpoint:
+    """ A single MedType server and the requests that are currently outstanding on it. """
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0
+        self.count_requests = 0
+        self.count_failed = 0
+
+        # Without health checks: the number of times the endpoint was drained since its last successful request,
+        # and when it will be tried again.
+        self.drains = 0
+        self.retry_at = None
+
+
+class EndpointPool:
+    """
+    A pool of MedType servers. Each request is sent to the healthy server with the fewest outstanding requests.
+    Servers that are unavailable for max_failures requests in a row (connection errors, timeouts or 502/503/504
+    responses) are drained (no longer sent requests) until a health check shows that they are accepting connections
+    again, or, with health checks disabled, until a backoff of DRAIN_BACKOFF seconds (doubling every time they are
+    drained again) has passed. Other server errors are blamed on the document rather than the server.
+
+    If resolve_urls is given, the pool is made up of every address their hostnames resolve to (see resolve_replicas()),
+    and they are resolved again before every health check, so that replicas can be added, removed or replaced (e.g.
+    by scaling or restarting a Kubernetes Deployment) while we're running.
+    """
+
+    def __init__(self, urls, max_failures=3, health_check_interval=30, unavailable_timeout=600, timeout=None, resolve_urls=None):
+        if resolve_urls:
+            urls = resolve_replicas(resolve_urls)
+        if not urls:
+            raise RuntimeError("At least one MedType URL is needed")
+
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.resolve_urls = resolve_urls
+        self.max_failures = max_failures
+        self.health_check_interval = health_check_interval
+        self.unavailable_timeout = unavailable_timeout
+        self.timeout = timeout
+        self.condition = threading.Condition()
+
+        if health_check_interval:
+            threading.Thread(target=self._health_check_loop, daemon=True).start()
+
+    @staticmethod
+    def probe(session, url):
+        """
+        Check whether a MedType server is accepting requests. MedType may not answer GET requests on its root, so
+        any response will do, as long as it isn't from a proxy reporting that the server is unavailable.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        try:
+            response = session.get(f'{parsed.scheme}://{parsed.netloc}/', timeout=10)
+        except requests.RequestException:
+            return False
+        return response.status_code not in UNAVAILABLE_STATUS_CODES
+
+    def check_health(self, session):
+        """ Probe every endpoint, draining the ones that are down and restoring the ones that have recovered. """
+        for endpoint in self.endpoints:
+            healthy = self.probe(session, endpoint.url)
+            with self.condition:
+                if healthy and not endpoint.healthy:
+                    logging.info(f"MedType endpoint {endpoint.url} has recovered, restoring it to the pool.")
+                    endpoint.failures = 0
+                elif not healthy and endpoint.healthy:
+                    logging.warning(f"MedType endpoint {endpoint.url} failed its health check, draining it.")
+                endpoint.healthy = healthy
+                self.condition.notify_all()
+
+    def update_endpoints(self, urls):
+        """ Add endpoints for new URLs and remove endpoints whose URLs are no longer in the list. """
+        with self.condition:
+            current = set(e.url for e in self.endpoints)
+            resolved = set(urls)
+            added = [url for url in urls if url not in current]
+            removed = [e for e in self.endpoints if e.url not in resolved]
+            if not added and not removed:
+                return
+
+            for endpoint in removed:
+                logging.info(f"MedType endpoint {endpoint.url} no longer resolves, removing it from the pool.")
+            for url in added:
+                logging.info(f"Found new MedType endpoint {url}, adding it to the pool.")
+
+            # Requests already sent to removed endpoints can still finish, since release() only updates the endpoint.
+            self.endpoints = [e for e in self.endpoints if e not in removed] + [Endpoint(url) for url in added]
+            self.condition.notify_all()
+
+    def _health_check_loop(self):
+        session = requests.Session()
+        while True:
+            time.sleep(self.health_check_interval)
+            if self.resolve_urls:
+                try:
+                    urls = resolve_replicas(self.resolve_urls, log=False)
+                except OSError as e:
+                    logging.warning(f"Could not resolve MedType replicas again, keeping the current endpoints: {e}")
+                else:
+                    if urls:
+                        self.update_endpoints(urls)
+            self.check_health(session)
+
+    def _readmit(self):
+        """
+        Without health checks, restore drained endpoints whose backoff has passed. Returns the number of seconds
+        until the next one will be, or None if there are none. Must be called with the condition held.
+        """
+        now = time.monotonic()
+        waits = []
+        for endpoint in self.endpoints:
+            if endpoint.healthy or endpoint.retry_at is None:
+                continue
+            if endpoint.retry_at <= now:
+                logging.info(f"Trying drained MedType endpoint {endpoint.url} again.")
+                endpoint.healthy = True
+                endpoint.failures = self.max_failures - 1
+                endpoint.retry_at = None
+            else:
+                waits.append(endpoint.retry_at - now)
+        return min(waits) if waits else None
+
+    def acquire(self):
+        """ Choose the least busy healthy endpoint, waiting for one to recover if they are all drained. """
+        deadline = time.monotonic() + self.unavailable_timeout
+        with self.condition:
+            while True:
+                next_retry = None if self.health_check_interval else self._readmit()
+                healthy = [e for e in self.endpoints if e.healthy]
+                if healthy:
+                    endpoint = min(healthy, key=lambda e: (e.outstanding, e.count_requests))
+                    endpoint.outstanding += 1
+                    endpoint.count_requests += 1
+                    return endpoint
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"No MedType endpoints have been healthy for {self.unavailable_timeout} seconds")
+                logging.warning("All MedType endpoints are drained, waiting for one to recover.")
+                self.condition.wait(remaining if next_retry is None else min(remaining, next_retry))
+
+    def release(self, endpoint, ok):
+        with self.condition:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                endpoint.drains = 0
+            else:
+                endpoint.failures += 1
+                endpoint.count_failed += 1
+                if endpoint.healthy and endpoint.failures >= self.max_failures:
+                    endpoint.healthy = False
+                    if self.health_check_interval:
+                        logging.warning(f"Draining MedType endpoint {endpoint.url} after {endpoint.failures} failures in a row.")
+                    else:
+                        backoff = min(DRAIN_BACKOFF * 2 ** endpoint.drains, MAX_DRAIN_BACKOFF)
+                        endpoint.drains += 1
+                        endpoint.retry_at = time.monotonic() + backoff
+                        logging.warning(f"Draining MedType endpoint {endpoint.url} for {backoff} seconds after "
+                                        f"{endpoint.failures} failures in a row.")
+            self.condition.notify_all()
+
+    def run_linker(self, session, url, pmid, text, entity_linker):
+        """
+        Like run_linker(), but sends the request to an endpoint from this pool (`url` is ignored). Requests that
+        fail because the endpoint is unavailable are retried on another endpoint; requests that fail with another
+        server error are retried DOCUMENT_ERROR_RETRIES times, without counting against the endpoint.
+        """
+        attempts = len(self.endpoints) + self.max_failures
+        document_errors = 0
+        for attempt in range(attempts):
+            endpoint = self.acquire()
+            try:
+                profiling.count('requests')
+                with profiling.timer('network'):
+                    response = session.post(endpoint.url, json=linker_request(pmid, text, entity_linker), timeout=self.timeout)
+            except requests.RequestException as e:
+                logging.warning(f"Could not connect to MedType endpoint {endpoint.url} for PMID {pmid}: {e}")
+                self.release(endpoint, ok=False)
+                continue
+
+            if response.status_code in UNAVAILABLE_STATUS_CODES:
+                logging.warning(f"MedType endpoint {endpoint.url} is unavailable for PMID {pmid}: {response}")
+                self.release(endpoint, ok=False)
+                continue
+
+            # The endpoint answered, so any other error is most likely caused by the request rather than the endpoint.
+            self.release(endpoint, ok=True)
+            if response.status_code >= 500 and document_errors < DOCUMENT_ERROR_RETRIES:
+                logging.warning(f"MedType endpoint {endpoint.url} returned an error for PMID {pmid}, retrying: {response}")
+                document_errors += 1
+                continue
+            if not response.ok:
+                logging.error(f"MedType returned an error for PMID {pmid}: {response}")
+                return None
+            return response.json()
+
+        logging.error(f"Giving up on PMID {pmid} after {attempts} attempts.")
+        return None
+
+    def log_summary(self):
+        for endpoint in self.endpoints:
+            logging.info(f"MedType endpoint {endpoint.url}: {endpoint.count_requests} requests, {endpoint.count_failed} failed, healthy = {endpoint.healthy}")
+
+
+def resolve_replicas(urls, log=True):
+    """
+    Expand each URL into one URL for every address its hostname resolves to, so that every replica behind a
+    headless Kubernetes Service (see kubernetes/medtype-server.deployment.k8s.yaml) becomes a separate endpoint.
+    """
+    expanded = []
+    for url in urls:
+        parsed = urllib.parse.urlsplit(url)
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or 80, proto=socket.IPPROTO_TCP)
+        addresses = sorted(set(info[4][0] for info in infos))
+        if log:
+            logging.info(f"Resolved {parsed.hostname} to {len(addresses)} MedType replicas: {addresses}")
+        for address in addresses:
+            host = f'[{address}]' if ':' in address else address
+            netloc = f'{host}:{parsed.port}' if parsed.port else host
+            expanded.append(urllib.parse.urlunsplit(parsed._replace(netloc=netloc)))
+    return expanded
+
+
+def create_session(pool_size=10):
+    """ Create a requests session that retries failed connections. """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(max_retries=3, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
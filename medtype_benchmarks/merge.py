@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# A script for merging information from multiple PubAnnotator files.
+# We can do it by multiple methods:
+#   - By default, we merge entries from all files; entries having the same
+#     source_url are assumed to be identical and their tracks will be merged
+#     rather than being duplicated.
+#   - However, you can also turn on `--annotate-first` mode, which will only
+#     add tracks to the first file given.
+
+import logging
+import json
+import os
+
+import click
+
+from . import profiling
+from .discovery import discovery_options, find_files
+
+logging.basicConfig(level=logging.INFO)
+
+def merge_file(input_path, output_file, kwargs):
+    """
+    Merge an individual file into an output using the criteria provided.
+
+    :param input_path: Input file path
+    :param output_file: Output file path
+    :param kwargs: configuration parameters from the command line
+    """
+
+    with open(input_path) as input:
+        for line in input:
+            profiling.count('bytes_read', len(line))
+            with profiling.timer('parse'):
+                entry = json.loads(line)
+            profiling.count('documents')
+
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', nargs=-1, type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--output', '-O', default='-', type=click.File('w'))
+@click.option('--annotate-first', type=bool)
+@discovery_options
+def merge(input, output, manifest, rescan, **kwargs):
+    """
+    merge.py [files or directories containing JSONL files to merge]
+    """
+    for inp in input:
+        input_path = click.format_filename(inp)
+
+        if os.path.isdir(input_path):
+            for input_file in find_files(input_path, manifest=manifest, rescan=rescan):
+                merge_file(input_file.path, output, kwargs)
+        else:
+            merge_file(input_path, output, kwargs)
+
+
+if __name__ == '__main__':
+    merge()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+#
+# Node Normalization script
+# Given a PubAnnotator input file and a track name, this script will create an additional track called
+# "<track name>+NodeNorm" which runs (one or more) matching entities with the Node Normalization service.
+#
+import os
+
+import requests
+import click
+import functools
+import json
+import logging
+
+from . import profiling
+from .babel_index import BabelIndex
+from .discovery import discovery_options, find_files
+from .sharding import ShardLedger, check_shard_options, shard_options
+from .text_store import TextStore, strip_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+s = requests.Session()
+a = requests.adapters.HTTPAdapter(max_retries=10)
+s.mount('http://', a)
+s.mount('https://', a)
+
+# A local Babel index to normalize terms with instead of the Node Normalization service (see babel_index.py).
+local_index = None
+
+
+# Look up terms on the Node Normalization service.
+@functools.cache
+def get_normalized_term(curie):
+    if local_index is not None:
+        return local_index.get_normalized_nodes([curie])
+
+    profiling.count('requests')
+    with profiling.timer('network'):
+        response = s.get('https://nodenormalization-sri.renci.org/1.2/get_normalized_nodes', params={
+            'curie': curie
+        })
+    if not response.ok:
+        logging.error("Could not look up MeSH {mesh_id} on the Node Normalization Service, skipping: {response}")
+        return {}
+
+    return response.json()
+
+
+@profiling.timed('normalize')
+def normalize_track(entry, track, first):
+    """
+    Add a '<track>+NodeNorm' track to an entry for every track with the given project name, with each denotation
+    normalized with the Node Normalization service. Returns True if the track was found in the entry.
+    """
+    # Look for the expected track.
+    tracks = entry['tracks']
+    if not isinstance(tracks, list):
+        tracks = [tracks]
+    flag_matched_track = False
+    for tr in tracks:
+        if tr['project'] == track:
+            flag_matched_track = True
+
+            # Normalize track and write to new_track
+            new_track = {
+                'project': f"{track}+NodeNorm",
+                'denotations': []
+            }
+
+            denotations = tr['denotations']
+            for denotation in denotations:
+                if not first:
+                    raise RuntimeError(f"Only 'first' is currently supported.")
+                else:
+                    link_ids = denotation['link_ids']
+                    if not link_ids:
+                        logging.warning(f"No link_id found in denotation {denotation} in entry {entry}")
+                        continue
+                    else:
+                        link_id = link_ids[0]
+
+                # TODO: improve very dumb UMLS ID check.
+                if link_id.startswith('C'):
+                    link_id = f"UMLS:{link_id}"
+
+                # Look up link_id via NodeNorm.
+                result = get_normalized_term(link_id)
+                if link_id in result and 'id' in result[link_id] and 'identifier' in result[link_id]['id']:
+                    denotation['link_ids'] = [result[link_id]['id']['identifier']]
+
+                    if 'type' in result[link_id]:
+                        denotation['obj'] = result[link_id]['type']
+
+                new_track['denotations'].append(denotation)
+
+            tracks.append(new_track)
+
+    return flag_matched_track
+
+
+def normalize_entry(filename, output_path, track, first, ledger=None, texts=None):
+    with open(filename, 'r') as f:
+        for (index, line) in enumerate(f):
+            if line.strip() == '':
+                continue
+
+            # Skip entries that belong to other shards, without parsing them if we can.
+            if ledger is not None and ledger.owns_line(line) is False:
+                continue
+
+            profiling.count('bytes_read', len(line))
+            with profiling.timer('parse'):
+                entry = json.loads(line)
+            logging.debug(f"{filename} line {index}: {entry}")
+
+            # Write the entry into the output file.
+            if entry['source_url'].startswith('https://pubmed.ncbi.nlm.nih.gov/'):
+                pmid = entry['source_url'][32:]
+                if pmid.endswith('/'):
+                    pmid = pmid[:-1]
+            else:
+                raise RuntimeError(f"Could not parse source ID: {entry['source_url']}")
+
+            if ledger is not None and not ledger.owns(pmid):
+                continue
+
+            # Check for existing output file.
+            output_filename = os.path.join(output_path, f"pmid_{pmid}.jsonl")
+            if os.path.exists(output_filename):
+                logging.info(f"Found output for PMID {pmid}, skipping.")
+                continue
+
+            flag_matched_track = normalize_track(entry, track, first)
+            profiling.count('documents')
+            if not flag_matched_track:
+                logging.warning(f"Track '{track}' not found in {filename}")
+
+            # Write to output.
+            if texts is not None:
+                entry = strip_text(entry, pmid, texts)
+            with profiling.timer('serialize'):
+                content = json.dumps(entry)
+            profiling.count('bytes_written', len(content))
+            with open(output_filename + '.in-progress', "w") as fout:
+                fout.write(content)
+
+            os.rename(output_filename + '.in-progress', output_filename)
+
+            if ledger is not None:
+                ledger.record(pmid)
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', default='-', type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    readable=True,
+    allow_dash=True
+))
+@click.option('--output-dir', '-O', default='-', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    writable=True,
+    allow_dash=True
+), help='Directory to write output files to')
+@click.option('--track', '-t', help='The track to normalize')
+@click.option('--first', is_flag=True, help='Only convert the first entity ID')
+@click.option('--babel-index', help='Normalize terms offline with a local Babel index (see babel_index.py) instead of the Node Normalization service', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    exists=True
+))
+@text_store_option
+@shard_options
+@discovery_options
+def nodenorm(input, output_dir, track, first, babel_index, text_store, shard_index, shard_count, manifest, rescan):
+    """
+    Given a PubAnnotator input file and a track name, this script will create an additional track called
+    'track+NodeNorm' with original track node normalized.
+    """
+    global local_index
+    if babel_index:
+        local_index = BabelIndex(click.format_filename(babel_index))
+
+    input_path = click.format_filename(input)
+    output_path = click.format_filename(output_dir)
+    texts = TextStore(click.format_filename(text_store)) if text_store else None
+
+    # When sharded, only process our share of the input and keep our outputs separate.
+    check_shard_options(shard_index, shard_count)
+    ledger = None
+    if shard_count > 1:
+        ledger = ShardLedger(output_path, shard_index, shard_count)
+        output_path = ledger.path
+
+    count_files = 0
+    count_other_shards = 0
+    if os.path.isdir(input_path):
+        for input_file in find_files(input_path, manifest=manifest, rescan=rescan):
+            # Per-PMID files that belong to other shards don't need to be opened at all.
+            if ledger is not None and input_file.pmid and not ledger.owns(input_file.pmid):
+                count_other_shards += 1
+                continue
+
+            count_files += 1
+            normalize_entry(input_file.path, output_path, track, first, ledger, texts)
+    else:
+        count_files += 1
+        normalize_entry(input_path, output_path, track, first, ledger, texts)
+
+    if ledger is not None:
+        ledger.finish(files=count_files, other_shard_files=count_other_shards)
+
+
+if __name__ == '__main__':
+    nodenorm()
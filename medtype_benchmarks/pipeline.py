@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+# An in-process pipeline that runs the benchmarking steps as a single streaming job.
+#
+# Rather than running pubmedds2pubannotator.py, query_medtype.py, nodenorm.py and score.py one after the other,
+# each writing complete intermediate files for the next one to read, this script chains the same functions as
+# stages running in their own threads and joined by bounded queues. Each document is converted, sent to MedType,
+# normalized and scored as soon as it has been read, and only the final PubAnnotator entries are written out.
+#
+# With --checkpoint, the PMIDs written to the output and the running scores are saved periodically, and a
+# restarted run continues from the last checkpoint.
+
+import logging
+import json
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from . import nodenorm
+from . import profiling
+from . import pubmedds2pubannotator
+from .babel_index import BabelIndex
+from .medtype_cache import DEFAULT_SERVER_VERSION, ResponseCache, cached_run_linker
+from .medtype_client import EndpointPool, create_session, query_text, result_to_track
+from .query_medtype import MEDTYPE_PROJECT, check_chunk_options
+from .raw_archive import RawArchive
+from .score import gold_counts_entry, gold_report_options, print_gold_report, print_results, score_entry
+from .sharding import SOURCE_URL_PMID
+from .text_store import TextStore, entry_text, strip_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+# Find the PMID in a PubMedDS line without parsing the whole line.
+PUBMEDDS_PMID = re.compile('"_id"\\s*:\\s*"?([^",}\\s]+)')
+
+# Marks the end of the items in a queue.
+_DONE = object()
+
+
+class _Failure:
+    """ An exception raised in a stage, to be re-raised by whoever reads that stage's output. """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def pipe(func, items, workers=1, queue_size=64):
+    """
+    Apply func to every item from an iterator in `workers` background threads, yielding the results in the order
+    they are completed. func may return None to drop an item. Both the input and the output of the stage are
+    bounded queues, so a slow stage holds up the stages before it instead of letting items pile up in memory.
+    """
+    inputs = queue.Queue(queue_size)
+    outputs = queue.Queue(queue_size)
+    remaining_workers = [workers]
+    lock = threading.Lock()
+
+    def feed():
+        try:
+            for item in items:
+                inputs.put(item)
+        except BaseException as e:
+            outputs.put(_Failure(e))
+        finally:
+            for _ in range(workers):
+                inputs.put(_DONE)
+
+    def work():
+        try:
+            while True:
+                item = inputs.get()
+                if item is _DONE:
+                    break
+                result = func(item)
+                if result is not None:
+                    outputs.put(result)
+        except BaseException as e:
+            outputs.put(_Failure(e))
+        finally:
+            with lock:
+                remaining_workers[0] -= 1
+                if remaining_workers[0] == 0:
+                    outputs.put(_DONE)
+
+    threading.Thread(target=feed, daemon=True).start()
+    for _ in range(workers):
+        threading.Thread(target=work, daemon=True).start()
+
+    while True:
+        result = outputs.get()
+        if result is _DONE:
+            return
+        if isinstance(result, _Failure):
+            raise result.exception
+        yield result
+
+
+def entry_pmid(entry):
+    source_url = entry['source_url']
+    if not source_url.startswith('https://pubmed.ncbi.nlm.nih.gov/'):
+        raise RuntimeError(f'Could not identify PubMed ID for source_url {source_url}')
+    return source_url[32:].rstrip('/')
+
+
+class Checkpoint:
+    """
+    The progress of a pipeline run. done.txt lists the PMIDs written to the output file, gold.jsonl the per-document
+    counts for --gold mode, and checkpoint.json records how much of done.txt, gold.jsonl and the output file had
+    been written when the running scores were last saved. Anything written after that is discarded when the run is
+    restarted, since it isn't reflected in the scores.
+    """
+
+    def __init__(self, path, output_path):
+        os.makedirs(path, exist_ok=True)
+        self.done_path = os.path.join(path, 'done.txt')
+        self.gold_path = os.path.join(path, 'gold.jsonl')
+        self.state_path = os.path.join(path, 'checkpoint.json')
+
+        self.state = {
+            'count': 0,
+            'output_offset': 0,
+            'gold_offset': 0,
+            'project_names': [],
+            'results': {}
+        }
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+            logging.info(f"Resuming from checkpoint with {self.state['count']} entries completed.")
+
+        # Checkpoints used to include the gold counts themselves; move them into gold.jsonl.
+        if 'gold_documents' in self.state:
+            with open(self.gold_path, 'w') as f:
+                f.writelines(json.dumps(document) + '\n' for document in self.state.pop('gold_documents'))
+                self.state['gold_offset'] = f.tell()
+
+        # Roll the output and the list of completed PMIDs back to the checkpoint.
+        if os.path.exists(output_path):
+            with open(output_path, 'r+b') as f:
+                f.truncate(self.state['output_offset'])
+        elif self.state['output_offset'] > 0:
+            raise RuntimeError(f"Checkpoint in {path} refers to output file {output_path}, which no longer exists")
+
+        done = []
+        if os.path.exists(self.done_path):
+            with open(self.done_path, 'r') as f:
+                done = [line.strip() for line in f][:self.state['count']]
+        with open(self.done_path, 'w') as f:
+            f.writelines(f'{pmid}\n' for pmid in done)
+        self.done = set(done)
+
+        self.gold_documents = []
+        if os.path.exists(self.gold_path):
+            with open(self.gold_path, 'r+b') as f:
+                f.truncate(self.state['gold_offset'])
+                f.seek(0)
+                self.gold_documents = [json.loads(line) for line in f]
+
+        self.done_file = open(self.done_path, 'a')
+        self.gold_file = open(self.gold_path, 'a')
+
+    def record(self, pmid):
+        self.done_file.write(f'{pmid}\n')
+
+    def record_gold(self, gold_result):
+        self.gold_file.write(json.dumps(gold_result) + '\n')
+
+    def save(self, count, output_offset, project_names, results):
+        self.done_file.flush()
+        self.gold_file.flush()
+        self.state = {
+            'count': count,
+            'output_offset': output_offset,
+            'gold_offset': self.gold_file.tell(),
+            'project_names': sorted(project_names),
+            'results': results
+        }
+        with open(self.state_path + '.in-progress', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + '.in-progress', self.state_path)
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', type=click.Path(
+    exists=True,
+    dir_okay=False,
+    file_okay=True
+))
+@click.option('--output', '-O', required=True, type=click.Path(
+    file_okay=True,
+    dir_okay=False
+), help='PubAnnotator JSONL file to write annotated entries to')
+@click.option('--pubmedds', is_flag=True, default=False, help='INPUT is a PubMedDS file, which will be converted into PubAnnotator first')
+@click.option('--pubmedds-normalize', is_flag=True, default=False, help='When converting PubMedDS, also add a normalized PubMedDS track (as pubmedds2pubannotator.py --normalize)')
+@click.option('--medtype/--no-medtype', default=True, show_default=True, help='Add a MedType track to every entry')
+@click.option('--url', help='URL of MedType server (repeat to spread requests across several servers)', default=['http://localhost:8125/run_linker'], multiple=True, type=str, show_default=True)
+@click.option('--resolve-replicas', is_flag=True, default=False, help='Treat every address the --url hostnames resolve to as a separate server, resolving them again at every health check')
+@click.option('--concurrency', help='Number of texts to send to MedType at the same time', default=4, type=int, show_default=True)
+@click.option('--timeout', help='Seconds to wait for a MedType server to respond before trying another one (0 to wait forever)', default=600, type=click.FloatRange(min=0), show_default=True)
+@click.option('--entity-linker', help='Entity linker to use', default='scispacy', type=str, show_default=True)
+@click.option('--max-chunk-size', help='Split texts longer than this many characters into chunks that are sent separately (0 to never split)', default=0, type=int, show_default=True)
+@click.option('--chunk-overlap', help='Number of characters shared by consecutive chunks when a single sentence has to be split', default=100, type=int, show_default=True)
+@click.option('--chunk-concurrency', help='Number of chunks of a single text to send to MedType at the same time', default=4, type=int, show_default=True)
+@click.option('--cache', help='Directory of cached MedType responses to consult before querying MedType', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--server-version', help='Version of the MedType server, used to key cached responses', default=DEFAULT_SERVER_VERSION, type=str, show_default=True)
+@click.option('--archive', help='Also store raw MedType outputs in a compressed archive in this directory', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--nodenorm', 'nodenorm_tracks', multiple=True, help='Add a normalized "<track>+NodeNorm" track for this track (as nodenorm.py --first)')
+@click.option('--babel-index', help='Normalize terms offline with a local Babel index instead of the Node Normalization service', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    exists=True
+))
+@click.option('--score', 'score_pairs', is_flag=True, default=False, help='Score every pair of projects (as score.py)')
+@click.option('--gold', help='Score every other track against this track (as score.py --gold)', type=str)
+@click.option('--filter', '-f', help='List of projects whose tracks should be scored (all other tracks are ignored)', multiple=True)
+@click.option('--bootstrap', help='Number of bootstrap replicates used to calculate confidence intervals in --gold mode', default=1000, type=click.IntRange(min=0), show_default=True)
+@click.option('--jobs', help='Number of processes to spread bootstrap replicates over', default=os.cpu_count(), type=click.IntRange(min=1), show_default=True)
+@gold_report_options
+@click.option('--checkpoint', help='Directory to save progress in, so that an interrupted run can be continued', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--checkpoint-every', help='Number of entries between checkpoints', default=100, type=click.IntRange(min=1), show_default=True)
+@text_store_option
+@click.option('--queue-size', help='Maximum number of entries waiting between two stages', default=64, type=click.IntRange(min=1), show_default=True)
+def pipeline(input, output, pubmedds, pubmedds_normalize, medtype, url, resolve_replicas, concurrency, timeout, entity_linker,
+             max_chunk_size, chunk_overlap, chunk_concurrency, cache, server_version, archive, nodenorm_tracks, babel_index, score_pairs,
+             gold, filter, bootstrap, jobs, confidence, seed, types_shown, checkpoint, checkpoint_every, text_store, queue_size):
+    """
+    pipeline.py [PubAnnotator or PubMedDS JSONL file] -O [PubAnnotator JSONL file to write]
+    """
+    check_chunk_options(max_chunk_size, chunk_overlap)
+    input_path = click.format_filename(input)
+    output_path = click.format_filename(output)
+
+    if babel_index:
+        local_index = BabelIndex(click.format_filename(babel_index))
+        nodenorm.local_index = local_index
+        pubmedds2pubannotator.local_index = local_index
+
+    texts = TextStore(click.format_filename(text_store)) if text_store else None
+
+    ckpt = Checkpoint(click.format_filename(checkpoint), output_path) if checkpoint else None
+    done = ckpt.done if ckpt else set()
+    count = ckpt.state['count'] if ckpt else 0
+    project_names = set(ckpt.state['project_names']) if ckpt else set()
+    results = ckpt.state['results'] if ckpt else {}
+    gold_documents = ckpt.gold_documents if ckpt else []
+
+    # Stage 1: read lines, skipping PMIDs that have already been completed.
+    pmid_pattern = PUBMEDDS_PMID if pubmedds else SOURCE_URL_PMID
+
+    def read_lines():
+        with open(input_path, 'r') as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                m = pmid_pattern.search(line)
+                if m and m.group(1) in done:
+                    continue
+                yield line
+
+    # Stage 2: parse (and convert) every entry.
+    def parse(line):
+        profiling.count('bytes_read', len(line))
+        with profiling.timer('parse'):
+            entry = json.loads(line)
+        if pubmedds:
+            with profiling.timer('convert'):
+                entry = pubmedds2pubannotator.convert_abstract(entry, normalize=pubmedds_normalize)
+
+        if entry_pmid(entry) in done:
+            return None
+        return entry
+
+    entries = pipe(parse, read_lines(), queue_size=queue_size)
+
+    # Stage 3: send every entry to MedType.
+    if medtype:
+        pool = EndpointPool(list(url), timeout=timeout or None, resolve_urls=list(url) if resolve_replicas else None)
+        session = create_session(pool_size=max(10, concurrency * max(1, chunk_concurrency)))
+        chunk_executor = ThreadPoolExecutor(max_workers=concurrency * chunk_concurrency) if max_chunk_size else None
+        raw_archive = RawArchive(click.format_filename(archive)) if archive else None
+        linker = pool.run_linker
+        if cache:
+            linker = cached_run_linker(ResponseCache(click.format_filename(cache)), server_version, pool.run_linker)
+
+        def annotate(entry):
+            pmid = entry_pmid(entry)
+            result = query_text(session, None, pmid, entry_text(entry, texts), entity_linker,
+                                max_chunk_size=max_chunk_size,
+                                chunk_overlap=chunk_overlap,
+                                executor=chunk_executor,
+                                linker=linker)
+            if result is None:
+                logging.error(f"Error occurred for PMID {pmid}, skipping.")
+                return None
+
+            if raw_archive is not None and pmid not in raw_archive:
+                raw_archive.put(pmid, result)
+
+            track = result_to_track(pmid, result, MEDTYPE_PROJECT)
+            if track is None:
+                logging.warning(f"No results found for PMID {pmid}.")
+            else:
+                if not isinstance(entry['tracks'], list):
+                    entry['tracks'] = [entry['tracks']]
+                entry['tracks'].append(track)
+            return entry
+
+        entries = pipe(annotate, entries, workers=concurrency, queue_size=queue_size)
+
+    # Stage 4: normalize tracks.
+    if nodenorm_tracks:
+        def normalize(entry):
+            for track in nodenorm_tracks:
+                if not nodenorm.normalize_track(entry, track, True):
+                    logging.warning(f"Track '{track}' not found for PMID {entry_pmid(entry)}")
+            return entry
+
+        entries = pipe(normalize, entries, queue_size=queue_size)
+
+    # Stage 5: write out and score every entry.
+    filter_set = set(filter)
+    with open(output_path, 'a' if ckpt else 'w') as fout:
+        for entry in entries:
+            pmid = entry_pmid(entry)
+            with profiling.timer('serialize'):
+                content = json.dumps(strip_text(entry, pmid, texts) if texts is not None else entry)
+            profiling.count('bytes_written', len(content) + 1)
+            profiling.count('documents')
+            fout.write(content)
+            fout.write('\n')
+
+            if score_pairs:
+                score_entry(entry, filter, project_names, results)
+            if gold:
+                gold_result = gold_counts_entry(entry, gold, filter_set)
+                if gold_result is not None:
+                    gold_documents.append(gold_result)
+                    if ckpt:
+                        ckpt.record_gold(gold_result)
+
+            count += 1
+            if ckpt:
+                ckpt.record(pmid)
+                if count % checkpoint_every == 0:
+                    fout.flush()
+                    ckpt.save(count, fout.tell(), project_names, results)
+                    logging.info(f"Checkpoint saved after {count} entries.")
+
+        if ckpt:
+            fout.flush()
+            ckpt.save(count, fout.tell(), project_names, results)
+
+    logging.info(f"Pipeline completed: {count} entries written to {output_path}.")
+    if medtype:
+        pool.log_summary()
+
+    if score_pairs:
+        print_results(results, 1)
+    if gold:
+        print_gold_report(gold, gold_documents, bootstrap, confidence, jobs, seed, types_shown)
+
+
+if __name__ == '__main__':
+    pipeline()
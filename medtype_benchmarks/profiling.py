@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Profiling hooks shared by the benchmark scripts.
+#
+# Every script accepts --profile PATH. When given, the script runs under cProfile and writes the profile to PATH
+# (readable with `python -m pstats PATH` or snakeviz), and at the end logs a summary of the named timers and
+# counters that the scripts update along their hot paths:
+#
+#   timers:   parse, network, convert, normalize, overlap, score, bootstrap, serialize
+#   counters: documents, requests, bytes_read, bytes_written
+#
+# cProfile only covers the main thread, but timers and counters are collected from every thread, so timers that
+# run in several threads at once can add up to more than the wall-clock time. Timers can also nest (network time
+# spent normalizing terms is counted in both 'network' and 'normalize'), and work done in worker processes (e.g.
+# score.py --gold --jobs) isn't counted. Byte counts are counted as characters of decoded text, which is the same
+# thing for ASCII-only JSON.
+#
+# When --profile isn't given, timer() returns a shared no-op context manager and count() returns immediately, so
+# the hooks cost no more than a function call.
+
+import logging
+import cProfile
+import functools
+import json
+import threading
+import time
+
+import click
+
+logging.basicConfig(level=logging.INFO)
+
+# The profile for the current run, or None if we're not profiling.
+_active = None
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('stats', 'name', 'started')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter_ns() - self.started)
+        return False
+
+
+def timer(name):
+    """ A context manager that adds the time spent inside it to the named timer. """
+    if _active is None:
+        return _NULL_TIMER
+    return _Timer(_active, name)
+
+
+def count(name, amount=1):
+    """ Add to a named counter. """
+    if _active is not None:
+        _active.add_count(name, amount)
+
+
+def timed(name):
+    """ A decorator that adds the time spent in a function to the named timer. """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return f(*args, **kwargs)
+            with _Timer(_active, name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profile:
+    """ Named timers and counters for a single run, along with a cProfile profile of the main thread. """
+
+    def __init__(self, path):
+        self.path = path
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.elapsed_ns = 0
+
+    def add_time(self, name, elapsed_ns):
+        with self.lock:
+            totals = self.timers.get(name)
+            if totals is None:
+                self.timers[name] = [elapsed_ns, 1]
+            else:
+                totals[0] += elapsed_ns
+                totals[1] += 1
+
+    def add_count(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def __enter__(self):
+        global _active
+        _active = self
+        self.started = time.perf_counter_ns()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self.profiler.disable()
+        self.elapsed_ns = time.perf_counter_ns() - self.started
+        _active = None
+
+        self.profiler.dump_stats(self.path)
+        with open(self.path + '.summary.json', 'w') as f:
+            json.dump(self.summary(), f, sort_keys=True, indent=4)
+        self.log_summary()
+        return False
+
+    def summary(self):
+        return {
+            'elapsed_secs': self.elapsed_ns / 1E9,
+            'timers': {name: {'secs': total / 1E9, 'calls': calls} for (name, (total, calls)) in self.timers.items()},
+            'counters': dict(self.counters)
+        }
+
+    def log_summary(self):
+        elapsed_secs = self.elapsed_ns / 1E9
+        logging.info(f"Profile written to {self.path} ({elapsed_secs:.2f} seconds elapsed).")
+        for (name, (total, calls)) in sorted(self.timers.items(), key=lambda t: -t[1][0]):
+            secs = total / 1E9
+            logging.info(f" - {name}: {secs:.3f} seconds in {calls} calls ({secs / calls * 1000:.3f} ms per call, "
+                         f"{secs / elapsed_secs if elapsed_secs else 0:.1%} of elapsed time)")
+        for (name, value) in sorted(self.counters.items()):
+            if name.startswith('bytes_') and elapsed_secs:
+                logging.info(f" - {name}: {value} ({value / elapsed_secs / 1E6:.2f} MB/s)")
+            else:
+                logging.info(f" - {name}: {value}")
+
+
+def profile_option(f):
+    """
+    Add the --profile option to a click command. This must be applied before click.command(), i.e. listed
+    directly below it.
+    """
+    @functools.wraps(f)
+    def wrapper(*args, profile=None, **kwargs):
+        if not profile:
+            return f(*args, **kwargs)
+        with Profile(click.format_filename(profile)):
+            return f(*args, **kwargs)
+
+    return click.option('--profile', help='Profile this run, writing a cProfile dump to this file and a summary of timers and counters to FILE.summary.json', type=click.Path(
+        file_okay=True,
+        dir_okay=False
+    ))(wrapper)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# A compact model of PubAnnotator documents, shared by the scripts that read PubAnnotator files.
+#
+# json.loads() turns every track and denotation into nested dictionaries, and every script then has to cope with
+# their variations: spans may be strings or ints, 'tracks' may be a list or a single track, and 'obj' and
+# 'link_ids' may be strings or lists. Document, Track and Denotation use __slots__, integer spans and tuples of
+# interned strings for projects, link_ids and types (which repeat across millions of denotations), and are built
+# lazily: Document.from_line() keeps the raw line until the document's fields are first accessed (so e.g. the PMID
+# of a document can be read without parsing it at all), and a Track only builds its Denotations when they are
+# first accessed.
+#
+# 'obj' and 'link_ids' keep their shape: a list in the input becomes a tuple, and a single string stays a string.
+
+import json
+import re
+import sys
+
+from . import profiling
+
+# Find the source_url in a PubAnnotator line without parsing the whole line.
+SOURCE_URL = re.compile('"source_url"\\s*:\\s*"([^"]*)"')
+
+PUBMED_URL_PREFIX = 'https://pubmed.ncbi.nlm.nih.gov/'
+
+# The denotation fields that Denotation has slots for; anything else goes into Denotation.extra.
+DENOTATION_FIELDS = frozenset(['id', 'span', 'obj', 'link_ids', 'text'])
+
+_intern_string = sys.intern
+
+
+def _intern(value):
+    """ Intern a string or every string in a list, returning a string or a tuple. """
+    if value is None:
+        return None
+    if value.__class__ is str:
+        return _intern_string(value)
+    try:
+        return tuple(map(_intern_string, value))
+    except TypeError:
+        return tuple(_intern_string(v) if isinstance(v, str) else v for v in value)
+
+
+def _as_json(value):
+    return list(value) if isinstance(value, tuple) else value
+
+
+def pmid_from_source_url(source_url):
+    if not source_url.startswith(PUBMED_URL_PREFIX):
+        raise RuntimeError(f"Could not parse source ID: {source_url}")
+    return source_url[len(PUBMED_URL_PREFIX):].rstrip('/')
+
+
+class Denotation:
+    """ A single denotation, with an integer span. Fields we don't know about are kept in `extra`. """
+
+    __slots__ = ('id', 'begin', 'end', 'obj', 'link_ids', 'text', 'extra')
+
+    def __init__(self, id, begin, end, obj=None, link_ids=None, text=None, extra=None):
+        self.id = id
+        self.begin = begin
+        self.end = end
+        self.obj = obj
+        self.link_ids = link_ids
+        self.text = text
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        # This is called for every denotation we read, so it fills in the slots directly instead of calling __init__.
+        denotation = object.__new__(cls)
+        span = d['span']
+        denotation.id = d.get('id')
+        denotation.begin = int(span['begin'])
+        denotation.end = int(span['end'])
+        denotation.obj = _intern(d.get('obj'))
+        denotation.link_ids = _intern(d.get('link_ids'))
+        denotation.text = d.get('text')
+        if len(d) <= len(DENOTATION_FIELDS) and DENOTATION_FIELDS.issuperset(d):
+            denotation.extra = None
+        else:
+            denotation.extra = {key: value for (key, value) in d.items() if key not in DENOTATION_FIELDS}
+        return denotation
+
+    def to_dict(self):
+        d = {'id': self.id}
+        if self.obj is not None:
+            d['obj'] = _as_json(self.obj)
+        d['span'] = {'begin': self.begin, 'end': self.end}
+        if self.link_ids is not None:
+            d['link_ids'] = _as_json(self.link_ids)
+        if self.text is not None:
+            d['text'] = self.text
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def __repr__(self):
+        return f"Denotation({self.id!r}, {self.begin}, {self.end}, obj={self.obj!r}, link_ids={self.link_ids!r})"
+
+
+class Track:
+    """ The denotations of a single project. Denotations are only built from the raw dictionaries when first accessed. """
+
+    __slots__ = ('project', '_denotations', '_raw')
+
+    def __init__(self, project, denotations=None):
+        self.project = sys.intern(project)
+        self._denotations = denotations if denotations is not None else []
+        self._raw = None
+
+    @classmethod
+    def from_dict(cls, d):
+        track = cls(d['project'])
+        track._raw = d.get('denotations', [])
+        return track
+
+    @property
+    def denotations(self):
+        if self._raw is not None:
+            with profiling.timer('parse'):
+                self._denotations = [Denotation.from_dict(d) for d in self._raw]
+            self._raw = None
+        return self._denotations
+
+    def to_dict(self):
+        if self._raw is not None:
+            return {'project': self.project, 'denotations': self._raw}
+        return {'project': self.project, 'denotations': [d.to_dict() for d in self._denotations]}
+
+
+class Document:
+    """
+    A PubAnnotator entry. Tracks are always a list. Top-level fields other than 'tracks' (text, text_ref,
+    source_db, ...) are kept in `fields` in their original order.
+    """
+
+    __slots__ = ('_line', '_fields', '_tracks', '_source_url')
+
+    def __init__(self, fields, tracks):
+        self._line = None
+        self._fields = fields
+        self._tracks = tracks
+        self._source_url = None
+
+    @classmethod
+    def from_dict(cls, entry):
+        tracks = entry.get('tracks', [])
+        if not isinstance(tracks, list):
+            tracks = [tracks]
+        fields = dict(entry)
+        fields['tracks'] = None
+        return cls(fields, [Track.from_dict(t) for t in tracks])
+
+    @classmethod
+    def from_line(cls, line):
+        """ A document for a JSONL line, which won't be parsed until its tracks or other fields are needed. """
+        document = cls(None, None)
+        document._line = line
+        return document
+
+    def _parse(self):
+        with profiling.timer('parse'):
+            parsed = Document.from_dict(json.loads(self._line))
+        self._fields = parsed._fields
+        self._tracks = parsed._tracks
+        self._line = None
+
+    @property
+    def source_url(self):
+        if self._source_url is None:
+            if self._line is not None:
+                m = SOURCE_URL.search(self._line)
+                if m:
+                    self._source_url = m.group(1)
+            if self._source_url is None:
+                self._source_url = self.fields['source_url']
+        return self._source_url
+
+    @property
+    def pmid(self):
+        return pmid_from_source_url(self.source_url)
+
+    @property
+    def fields(self):
+        if self._line is not None:
+            self._parse()
+        return self._fields
+
+    @property
+    def tracks(self):
+        if self._line is not None:
+            self._parse()
+        return self._tracks
+
+    def track(self, project):
+        """ The first track for a project, or None. """
+        for track in self.tracks:
+            if track.project == project:
+                return track
+        return None
+
+    def to_dict(self):
+        if self._line is not None:
+            return json.loads(self._line)
+
+        entry = {}
+        for (key, value) in self._fields.items():
+            entry[key] = [t.to_dict() for t in self._tracks] if key == 'tracks' else value
+        if 'tracks' not in entry:
+            entry['tracks'] = [t.to_dict() for t in self._tracks]
+        return entry
+
+    def to_json(self):
+        """ The document as a JSON line (without a trailing newline), reusing the original line if it was never parsed. """
+        if self._line is not None:
+            return self._line.rstrip('\n')
+        return json.dumps(self.to_dict())
+
+
+def as_document(entry):
+    """ Accept either a Document or an entry dictionary (e.g. from pipeline.py). """
+    if isinstance(entry, Document):
+        return entry
+    return Document.from_dict(entry)
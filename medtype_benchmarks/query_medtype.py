@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# This script goes through a PubAnnotator file, sends the text to MedType, and adds annotations
+# back to the PubAnnotator file.
+#
+# With several --entity-linker options, every text is sent to each entity linker at the same time, and each
+# linker's annotations are added as a separate track (named MedType-default-2022feb7-<linker>) to the same
+# pmid-*.jsonl output. The raw MedType outputs of each linker are then kept in their own <linker>/ subdirectory
+# of the output directory (or of the --archive directory), so they can be re-projected separately.
+
+import collections
+import logging
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from . import profiling
+from .medtype_cache import DEFAULT_SERVER_VERSION, ResponseCache, cached_run_linker, parse_size
+from .medtype_client import EndpointPool, create_session, query_text, result_to_track
+from .raw_archive import RawArchive
+from .sharding import ShardLedger, check_shard_options, shard_options, shard_path
+from .text_store import TextStore, entry_text, strip_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+
+# The project name for MedType tracks.
+MEDTYPE_PROJECT = 'MedType-default-2022feb7'
+
+
+class LinkerOutput:
+    """
+    Where the raw MedType outputs of one entity linker are kept (raw-pmid-*.json files in a directory, or a raw
+    archive), and the project name of the track made from them.
+    """
+
+    def __init__(self, entity_linker, project, raw_path, raw_archive=None):
+        self.entity_linker = entity_linker
+        self.project = project
+        self.raw_path = raw_path
+        self.raw_archive = raw_archive
+        if raw_archive is None:
+            os.makedirs(raw_path, exist_ok=True)
+
+    def raw_output_path(self, pmid):
+        return os.path.join(self.raw_path, f'raw-pmid-{pmid}.json')
+
+    def has(self, pmid):
+        if self.raw_archive is not None and pmid in self.raw_archive:
+            return True
+        return os.path.exists(self.raw_output_path(pmid))
+
+    def get(self, pmid):
+        if self.raw_archive is not None and pmid in self.raw_archive:
+            return self.raw_archive.get(pmid)
+        with open(self.raw_output_path(pmid), 'r') as f:
+            return json.load(f)
+
+    def put(self, pmid, result):
+        """ Write out a raw MedType output, returning a description of where it was written. """
+        if self.raw_archive is not None:
+            self.raw_archive.put(pmid, result)
+            return f'{self.raw_archive.path} (PMID {pmid})'
+
+        raw_output_path = self.raw_output_path(pmid)
+        with open(raw_output_path + '.in-process', 'w') as f:
+            json.dump(result, f, sort_keys=True, indent=4)
+
+        os.rename(raw_output_path + '.in-process', raw_output_path)
+        return raw_output_path
+
+
+def check_chunk_options(max_chunk_size, chunk_overlap):
+    if max_chunk_size and chunk_overlap * 2 >= max_chunk_size:
+        raise click.BadParameter(f"Chunk overlap {chunk_overlap} must be less than half the maximum chunk size "
+                                 f"{max_chunk_size}", param_hint='--chunk-overlap')
+
+
+def linker_outputs(entity_linkers, output_path, archive_path):
+    """
+    The LinkerOutput for each entity linker. A single linker keeps its raw outputs directly in the output (or
+    archive) directory, as before; several linkers each get a subdirectory and a project name of their own.
+    """
+    if len(entity_linkers) == 1:
+        return [LinkerOutput(entity_linkers[0], MEDTYPE_PROJECT, output_path,
+                             RawArchive(archive_path) if archive_path else None)]
+
+    return [LinkerOutput(entity_linker, f'{MEDTYPE_PROJECT}-{entity_linker}', os.path.join(output_path, entity_linker),
+                         RawArchive(os.path.join(archive_path, entity_linker)) if archive_path else None)
+            for entity_linker in entity_linkers]
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', type=click.File('r'))
+@click.argument('output', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--url', help='URL of MedType server (repeat to spread requests across several servers)', default=['http://localhost:8125/run_linker'], multiple=True, type=str, show_default=True)
+@click.option('--resolve-replicas', is_flag=True, default=False, help='Treat every address the --url hostnames resolve to as a separate server (e.g. for a headless Kubernetes Service), resolving them again at every health check')
+@click.option('--concurrency', help='Number of texts to send to MedType at the same time', default=1, type=int, show_default=True)
+@click.option('--health-check-interval', help='Seconds between health checks of the MedType servers (0 to disable, in which case drained servers are tried again after a backoff of 10 seconds, doubling up to 5 minutes)', default=30, type=int, show_default=True)
+@click.option('--timeout', help='Seconds to wait for a MedType server to respond before trying another one (0 to wait forever)', default=600, type=click.FloatRange(min=0), show_default=True)
+@click.option('--entity-linker', help='Entity linker to use (repeat to annotate every text with several linkers, adding a track for each)', default=['scispacy'], multiple=True, type=str, show_default=True)
+@click.option('--archive', help='Store raw MedType outputs in a compressed archive in this directory instead of raw-pmid-*.json files', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--max-chunk-size', help='Split texts longer than this many characters into chunks that are sent separately (0 to never split)', default=0, type=int, show_default=True)
+@click.option('--chunk-overlap', help='Number of characters shared by consecutive chunks when a single sentence has to be split', default=100, type=int, show_default=True)
+@click.option('--chunk-concurrency', help='Number of chunks of a single text to send to MedType at the same time', default=4, type=int, show_default=True)
+@click.option('--cache', help='Directory of cached MedType responses to consult before querying MedType', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--cache-max-size', help='Evict least recently used responses once the cache is larger than this (e.g. 500M, 20G)', type=str)
+@click.option('--server-version', help='Version of the MedType server, used to key cached responses', default=DEFAULT_SERVER_VERSION, type=str, show_default=True)
+@text_store_option
+@shard_options
+def query_medtype(input, output, url, resolve_replicas, concurrency, health_check_interval, timeout, entity_linker, archive,
+                  max_chunk_size, chunk_overlap, chunk_concurrency, cache, cache_max_size, server_version, text_store,
+                  shard_index, shard_count):
+    """
+    query_medtype.py [PubAnnotator JSONL file to annotate] [directory to write outputs to]
+    """
+    output_path = click.format_filename(output)
+    archive_path = click.format_filename(archive) if archive else None
+
+    # When sharded, only process our share of the input and keep our outputs separate.
+    check_shard_options(shard_index, shard_count)
+    check_chunk_options(max_chunk_size, chunk_overlap)
+    ledger = None
+    if shard_count > 1:
+        ledger = ShardLedger(output_path, shard_index, shard_count)
+        output_path = ledger.path
+        if archive_path:
+            archive_path = shard_path(archive_path, shard_index, shard_count)
+
+    os.makedirs(output_path, exist_ok=True)
+    entity_linkers = list(dict.fromkeys(entity_linker))
+    outputs = linker_outputs(entity_linkers, output_path, archive_path)
+    texts = TextStore(click.format_filename(text_store)) if text_store else None
+
+    pool = EndpointPool(list(url), health_check_interval=health_check_interval, timeout=timeout or None,
+                        resolve_urls=list(url) if resolve_replicas else None)
+    session = create_session(pool_size=max(10, concurrency * max(1, chunk_concurrency) * len(outputs)))
+    chunk_executor = ThreadPoolExecutor(max_workers=chunk_concurrency) if max_chunk_size else None
+    linker_executor = ThreadPoolExecutor(max_workers=concurrency * len(outputs)) if len(outputs) > 1 else None
+
+    linker = pool.run_linker
+    if cache:
+        response_cache = ResponseCache(click.format_filename(cache), max_size=parse_size(cache_max_size) if cache_max_size else None)
+        linker = cached_run_linker(response_cache, server_version, pool.run_linker)
+
+    # Count entries as they are completed.
+    count_processed = 0
+    count_failed = 0
+    progress_lock = threading.Lock()
+
+    def query(pmid, text, entity_linker):
+        return query_text(session, None, pmid, text, entity_linker,
+                          max_chunk_size=max_chunk_size,
+                          chunk_overlap=chunk_overlap,
+                          executor=chunk_executor,
+                          linker=linker)
+
+    def annotate(index, pmid, entry):
+        """ Send an entry to MedType and write out the raw MedType outputs and the annotated entry. """
+        nonlocal count_processed, count_failed
+
+        # Submit text to every entity linker we don't already have a raw output for, and get their responses.
+        pending = [o for o in outputs if not o.has(pmid)]
+        text = entry_text(entry, texts)
+        if linker_executor is not None and len(pending) > 1:
+            futures = [linker_executor.submit(query, pmid, text, o.entity_linker) for o in pending]
+            pending_results = [future.result() for future in futures]
+        else:
+            pending_results = [query(pmid, text, o.entity_linker) for o in pending]
+
+        # To simplify future runs, let's write out the raw MedType outputs first.
+        raw_output_paths = []
+        for (o, result) in zip(pending, pending_results):
+            if result is not None:
+                logging.info(f"Entities for PMID {pmid} ({o.entity_linker}): {json.dumps(result, sort_keys=True, indent=4)}")
+                raw_output_paths.append(o.put(pmid, result))
+
+        if any(result is None for result in pending_results):
+            failed = [o.entity_linker for (o, result) in zip(pending, pending_results) if result is None]
+            logging.error(f"Error occurred for PMID {pmid} with entity linker(s) {failed}, skipping.")
+            with progress_lock:
+                count_failed += 1
+            return
+
+        results_by_linker = dict(zip([o.entity_linker for o in pending], pending_results))
+        results = [results_by_linker[o.entity_linker] if o.entity_linker in results_by_linker else o.get(pmid) for o in outputs]
+        raw_output_path = ', '.join(raw_output_paths)
+
+        # Let's write out results in PubAnnotator format.
+        pubannotator_path = os.path.join(output_path, f'pmid-{pmid}.jsonl')
+        with open(pubannotator_path, 'w') as f_pubannotator:
+            medtype_tracks = [result_to_track(pmid, result, o.project) for (o, result) in zip(outputs, results)]
+            medtype_tracks = [track for track in medtype_tracks if track is not None]
+            if not medtype_tracks:
+                logging.warning(f"No results found for PMID {pmid}, skipping.")
+                if ledger is not None:
+                    ledger.record(pmid)
+                return
+
+            pubannotator_entry = strip_text(entry, pmid, texts) if texts is not None else entry
+            if not isinstance(pubannotator_entry['tracks'], list):
+                pubannotator_entry['tracks'] = [pubannotator_entry['tracks']]
+            pubannotator_entry['tracks'].extend(medtype_tracks)
+            with profiling.timer('serialize'):
+                content = json.dumps(pubannotator_entry)
+            profiling.count('bytes_written', len(content))
+            f_pubannotator.write(content)
+
+        if ledger is not None:
+            ledger.record(pmid)
+
+        # What rate are we going at?
+        profiling.count('documents')
+        with progress_lock:
+            count_processed += 1
+            time_processed_secs = (time.time_ns() - time_started)/1E9
+            processed_per_second = count_processed/time_processed_secs
+
+        logging.info(f"Raw MedType output written to {raw_output_path}. (#{index}, {1/processed_per_second:.3f} seconds/entry)")
+
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    in_flight = collections.deque()
+
+    # Look through JSONL input file.
+    count_done = 0
+    count_skipped = 0
+    count_other_shards = 0
+    time_started = time.time_ns()
+    for line in input:
+        # Skip entries that belong to other shards, without parsing them if we can.
+        if ledger is not None and ledger.owns_line(line) is False:
+            count_other_shards += 1
+            continue
+
+        profiling.count('bytes_read', len(line))
+        with profiling.timer('parse'):
+            entry = json.loads(line)
+        logging.debug(f"Loaded entry: {json.dumps(entry, sort_keys=True, indent=4)}")
+
+        # Get PMID.
+        source_url = entry['source_url']
+        if source_url.startswith('https://pubmed.ncbi.nlm.nih.gov/'):
+            pmid = source_url[32:]
+            if pmid.endswith('/'):
+                pmid = pmid[:-1]
+        else:
+            raise RuntimeError(f'Could not identify PubMed ID for source_url {source_url}')
+
+        if ledger is not None and not ledger.owns(pmid):
+            count_other_shards += 1
+            continue
+
+        # Increment count
+        count_done += 1
+
+        # Do the raw outputs (for every entity linker) already exist?
+        if all(o.has(pmid) for o in outputs):
+            logging.info(f'Raw output for PMID {pmid} already exists, skipping. (#{count_done})')
+            count_skipped += 1
+            continue
+
+        if executor is None:
+            annotate(count_done, pmid, entry)
+        else:
+            in_flight.append(executor.submit(annotate, count_done, pmid, entry))
+
+            # Don't read too far ahead of the requests we've already sent.
+            while len(in_flight) >= concurrency * 2:
+                in_flight.popleft().result()
+
+    while in_flight:
+        in_flight.popleft().result()
+
+    pool.log_summary()
+
+    if ledger is not None:
+        ledger.finish(
+            entries=count_done,
+            processed=count_processed,
+            skipped=count_skipped,
+            failed=count_failed,
+            other_shards=count_other_shards
+        )
+
+
+if __name__ == '__main__':
+    query_medtype()
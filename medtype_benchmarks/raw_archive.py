@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# A compact archive for raw MedType responses.
+#
+# query_medtype.py used to write every raw MedType response pretty-printed into its own raw-pmid-*.json file.
+# The filtered_candidates lists make these files much larger than the annotations we actually use, so this
+# archive stores the same responses minified and compressed in appendable shards:
+#   - shard-00000.jsonl.zst (or shard-00000.jsonl.gz if zstandard is not installed): every response is
+#     written as its own zstd frame (or gzip member), so shards can be appended to, and a complete shard can
+#     still be decompressed with `zstdcat`/`zcat` into a JSONL file of {"pmid": ..., "response": ...} objects.
+#   - index.tsv: one line per response with the PMID, the shard and the offset and length of its frame, so that
+#     we can read a single response by PMID without decompressing the rest of the shard.
+
+import logging
+import json
+import glob
+import gzip
+import os
+import re
+import threading
+
+import click
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+
+# Start a new shard once the current one reaches this size (in bytes).
+DEFAULT_MAX_SHARD_SIZE = 256 * 1024 * 1024
+
+INDEX_FILENAME = 'index.tsv'
+SHARD_EXTENSIONS = {
+    'zstd': '.jsonl.zst',
+    'gzip': '.jsonl.gz'
+}
+
+
+def default_compression():
+    """ Use zstd if it is available, otherwise fall back to gzip. """
+    return 'zstd' if zstandard else 'gzip'
+
+
+class RawArchive:
+    """
+    An appendable, compressed archive of raw MedType responses that can be randomly accessed by PMID.
+    """
+
+    def __init__(self, path, compression=None, max_shard_size=DEFAULT_MAX_SHARD_SIZE):
+        self.path = path
+        self.compression = compression or default_compression()
+        if self.compression not in SHARD_EXTENSIONS:
+            raise RuntimeError(f"Unknown compression '{self.compression}', expected one of: {list(SHARD_EXTENSIONS)}")
+        if self.compression == 'zstd' and not zstandard:
+            raise RuntimeError("zstd compression requires the zstandard package (pip install zstandard)")
+        self.max_shard_size = max_shard_size
+
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, INDEX_FILENAME)
+
+        # Load the index: pmid -> (shard, offset, length). Later lines override earlier ones.
+        self.index = {}
+        if os.path.exists(self.index_path):
+            complete_length = 0
+            with open(self.index_path, 'rb') as f:
+                for raw_line in f:
+                    # A line without a newline was interrupted mid-write, so its frame may be incomplete. We cut it
+                    # off below, so that the next put() doesn't append its line onto the end of it.
+                    if not raw_line.endswith(b'\n'):
+                        logging.warning(f"Ignoring incomplete line at the end of {self.index_path}: {raw_line!r}")
+                        break
+                    complete_length += len(raw_line)
+
+                    # Archives written before incomplete lines were cut off may have lines that run into each other.
+                    fields = raw_line.decode('utf-8').rstrip('\n').split('\t')
+                    if len(fields) != 4 or not fields[2].isdigit() or not fields[3].isdigit():
+                        logging.warning(f"Ignoring malformed line in {self.index_path}: {raw_line!r}")
+                        continue
+                    (pmid, shard, offset, length) = fields
+                    self.index[pmid] = (shard, int(offset), int(length))
+
+            if complete_length < os.path.getsize(self.index_path):
+                os.truncate(self.index_path, complete_length)
+
+        self.current_shard = None
+        self.lock = threading.Lock()
+
+    def __contains__(self, pmid):
+        return str(pmid) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def pmids(self):
+        return self.index.keys()
+
+    def _shard_for_writing(self, extension):
+        """ Return the name of the shard we should append to next, starting a new one if needed. """
+        if self.current_shard is None:
+            shards = sorted(glob.glob(os.path.join(self.path, 'shard-*' + extension)))
+            self.current_shard = os.path.basename(shards[-1]) if shards else f'shard-00000{extension}'
+
+        if os.path.exists(os.path.join(self.path, self.current_shard)) and \
+                os.path.getsize(os.path.join(self.path, self.current_shard)) >= self.max_shard_size:
+            m = re.match('^shard-(\\d+)', self.current_shard)
+            self.current_shard = f'shard-{int(m.group(1)) + 1:05d}{extension}'
+
+        return self.current_shard
+
+    def _compress(self, data):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=9).compress(data)
+        return gzip.compress(data, compresslevel=9)
+
+    @staticmethod
+    def _decompress(shard, data):
+        if shard.endswith(SHARD_EXTENSIONS['zstd']):
+            if not zstandard:
+                raise RuntimeError(f"Shard {shard} is zstd-compressed, but the zstandard package is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def put(self, pmid, response):
+        """ Add a raw MedType response for a PMID to this archive. """
+        pmid = str(pmid)
+        record = json.dumps({'pmid': pmid, 'response': response}, separators=(',', ':')) + '\n'
+        frame = self._compress(record.encode('utf-8'))
+
+        with self.lock:
+            shard = self._shard_for_writing(SHARD_EXTENSIONS[self.compression])
+            with open(os.path.join(self.path, shard), 'ab') as f:
+                offset = f.tell()
+                f.write(frame)
+
+            # Only index the frame once it has been completely written.
+            with open(self.index_path, 'a') as f:
+                f.write(f'{pmid}\t{shard}\t{offset}\t{len(frame)}\n')
+            self.index[pmid] = (shard, offset, len(frame))
+
+    def get(self, pmid):
+        """ Return the raw MedType response for a PMID, or None if it isn't in this archive. """
+        pmid = str(pmid)
+        if pmid not in self.index:
+            return None
+
+        shard, offset, length = self.index[pmid]
+        with open(os.path.join(self.path, shard), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+
+        return json.loads(self._decompress(shard, data))['response']
+
+    def items(self):
+        """ Iterate over (pmid, response) pairs in the order they were added. """
+        for pmid in list(self.index.keys()):
+            yield pmid, self.get(pmid)
+
+
+@click.group()
+def raw_archive():
+    """
+    raw_archive.py [command] -- manage compressed archives of raw MedType responses.
+    """
+    pass
+
+
+@raw_archive.command()
+@click.argument('input', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.argument('archive', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--compression', type=click.Choice(list(SHARD_EXTENSIONS)), help='Compression to use for new shards [default: zstd if available, otherwise gzip]')
+@click.option('--delete', is_flag=True, default=False, help='Delete raw-pmid-*.json files once they have been archived')
+def convert(input, archive, compression, delete):
+    """
+    Convert a directory of raw-pmid-*.json files into an archive.
+    """
+    input_path = click.format_filename(input)
+    arch = RawArchive(click.format_filename(archive), compression=compression)
+
+    count_added = 0
+    count_skipped = 0
+    for filename in glob.iglob(f'{input_path}/**/raw-pmid-*.json', recursive=True):
+        m = re.match('^raw-pmid-(.+)\\.json$', os.path.basename(filename))
+        pmid = m.group(1)
+
+        if pmid in arch:
+            logging.debug(f"PMID {pmid} is already archived, skipping.")
+            count_skipped += 1
+        else:
+            with open(filename, 'r') as f:
+                arch.put(pmid, json.load(f))
+            count_added += 1
+
+        if delete:
+            os.remove(filename)
+
+    logging.info(f"Archived {count_added} raw outputs to {arch.path} ({count_skipped} already present, {len(arch)} in total).")
+
+
+@raw_archive.command()
+@click.argument('archive', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.argument('pmid', nargs=-1)
+@click.option('--output', '-O', default='-', type=click.File('w'))
+def get(archive, pmid, output):
+    """
+    Write out the raw MedType responses for one or more PMIDs.
+    """
+    arch = RawArchive(click.format_filename(archive))
+    for p in pmid:
+        response = arch.get(p)
+        if response is None:
+            logging.error(f"PMID {p} not found in archive {arch.path}")
+            continue
+        json.dump(response, output, sort_keys=True, indent=4)
+        output.write('\n')
+
+
+@raw_archive.command()
+@click.argument('archive', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.argument('output', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+def export(archive, output):
+    """
+    Write out every response in an archive as a raw-pmid-*.json file.
+    """
+    arch = RawArchive(click.format_filename(archive))
+    output_path = click.format_filename(output)
+    os.makedirs(output_path, exist_ok=True)
+
+    for pmid, response in arch.items():
+        with open(os.path.join(output_path, f'raw-pmid-{pmid}.json'), 'w') as f:
+            json.dump(response, f, sort_keys=True, indent=4)
+
+    logging.info(f"Exported {len(arch)} raw outputs to {output_path}.")
+
+
+if __name__ == '__main__':
+    raw_archive()
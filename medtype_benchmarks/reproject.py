@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# Regenerate MedType tracks from stored raw MedType outputs, without querying MedType again.
+#
+# query_medtype.py keeps the raw response for every PMID (as raw-pmid-*.json files or in a raw archive), but
+# converts it into a track with fixed rules: a single project name, and every one of the filtered_candidates as
+# link_ids. This script reads the raw responses in bulk and converts them again under different projection rules
+# (project name, candidate list, number of candidates, score threshold, predicted types), so trying out a variant
+# only costs CPU time. Several projections can be applied in the same pass (with --rules), adding one track each.
+#
+# Responses are split into shards by PMID (with the same hash as sharding.py), and each shard is converted by its
+# own worker process and written to OUTPUT/shard-I-of-N.jsonl. With --input, the tracks are added to the entries
+# of an existing PubAnnotator file (replacing any tracks with the same project names), and every input entry is
+# written out, so the output has the same entries as the input: entries without a raw output keep their tracks as
+# they are, and entries MedType found nothing in get empty tracks. Otherwise every entry only has its PMID, the
+# text and the new tracks, and PMIDs whose raw response doesn't include the text are skipped, since their entries
+# would have no text. With --text-store, texts are written to the text store and the entries refer to them with a
+# text_ref instead.
+
+import array
+import logging
+import json
+import multiprocessing
+import os
+import re
+
+import click
+
+from . import profiling
+from .discovery import discovery_options, find_files
+from .medtype_client import Projection
+from .pubannotator import pmid_from_source_url
+from .query_medtype import MEDTYPE_PROJECT
+from .raw_archive import INDEX_FILENAME, RawArchive
+from .sharding import SOURCE_URL_PMID, shard_archives, shard_of
+from .text_store import TextStore, strip_text, text_store_option
+
+logging.basicConfig(level=logging.INFO)
+
+# Find the PMID in the name of a raw MedType output file.
+RAW_FILENAME_PMID = re.compile('^raw-pmid-(.+)\\.json$')
+
+# Counts reported by every shard.
+COUNTS = ('documents', 'tracks', 'denotations', 'empty', 'not_in_input', 'without_raw_output', 'without_text')
+
+
+def find_raw_outputs(sources, manifest=None, rescan=False):
+    """
+    Find the raw MedType output for every PMID in a list of raw archives and directories of raw-pmid-*.json files,
+    returning a dictionary of PMID -> (kind, path), where kind is 'archive' or 'file'. Later sources take
+    precedence over earlier ones.
+
+    A single source may only have one raw output per PMID: the outputs of a query_medtype.py run with several
+    entity linkers (in <output>/<linker>/ or <archive>/<linker>/) need to be reprojected one linker at a time.
+    """
+    raw_outputs = {}
+    for source in sources:
+        found = {}
+        if os.path.exists(os.path.join(source, INDEX_FILENAME)):
+            for pmid in RawArchive(source).pmids():
+                found[pmid] = ('archive', source)
+            logging.info(f"Found {len(found)} raw outputs in archive {source}.")
+        else:
+            linker_archives = shard_archives(source)
+            if linker_archives:
+                raise click.ClickException(f"{source} contains a raw archive for each of several entity linkers; "
+                                           f"reproject one of them at a time: {sorted(linker_archives.values())}")
+
+            duplicates = []
+            for input_file in find_files(source, suffix='.json', manifest=manifest, rescan=rescan):
+                m = RAW_FILENAME_PMID.match(os.path.basename(input_file.path))
+                if m:
+                    if m.group(1) in found:
+                        duplicates.append((found[m.group(1)][1], input_file.path))
+                    found[m.group(1)] = ('file', input_file.path)
+            if duplicates:
+                raise click.ClickException(f"{len(duplicates)} PMIDs have more than one raw-pmid-*.json file in {source} "
+                                           f"(e.g. {duplicates[0][0]} and {duplicates[0][1]}); if these are the outputs "
+                                           f"of several entity linkers, reproject one linker's directory at a time")
+            logging.info(f"Found {len(found)} raw-pmid-*.json files in {source}.")
+
+        replaced = sum(1 for pmid in found if pmid in raw_outputs)
+        if replaced:
+            logging.info(f"Raw outputs in {source} replace those from earlier sources for {replaced} PMIDs.")
+        raw_outputs.update(found)
+    return raw_outputs
+
+
+def input_offsets(input_path, shard_count):
+    """
+    Read the input file once, returning the byte offsets of the lines that belong to each shard, so that shard
+    workers can read their own lines without reading the whole file.
+    """
+    offsets = [array.array('q') for _ in range(shard_count)]
+    with open(input_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                m = SOURCE_URL_PMID.search(line.decode('utf-8'))
+                pmid = m.group(1) if m else pmid_from_source_url(json.loads(line)['source_url'])
+                offsets[shard_of(pmid, shard_count)].append(offset)
+            offset += len(line)
+    return offsets
+
+
+class RawReader:
+    """ Reads raw MedType outputs from files or archives, keeping archives open between reads. """
+
+    def __init__(self):
+        self.archives = {}
+
+    def get(self, pmid, kind, path):
+        with profiling.timer('parse'):
+            if kind == 'archive':
+                if path not in self.archives:
+                    self.archives[path] = RawArchive(path)
+                return self.archives[path].get(pmid)
+            with open(path, 'r') as f:
+                return json.load(f)
+
+
+def project_tracks(pmid, result, projections, counts):
+    """ Apply every projection to a raw MedType response, returning the tracks that aren't empty. """
+    tracks = []
+    with profiling.timer('convert'):
+        for projection in projections:
+            track = projection.track(pmid, result)
+            if track is not None:
+                tracks.append(track)
+                counts['tracks'] += 1
+                counts['denotations'] += len(track['denotations'])
+    return tracks
+
+
+def raw_text(result):
+    """ The text of a raw MedType response, if MedType included it. """
+    elinks = result['result']['elinks']
+    return elinks[0].get('text') if elinks else None
+
+
+def reproject_shard(args):
+    """
+    Convert the raw outputs of one shard and write them to output_path/shard-I-of-N.jsonl. Returns the counts.
+    """
+    (shard_index, shard_count, raw_outputs, projections, input_path, offsets, output_path, text_store_path) = args
+    counts = dict.fromkeys(COUNTS, 0)
+    reader = RawReader()
+    texts = TextStore(text_store_path) if text_store_path else None
+    project_names = set(projection.project for projection in projections)
+    filename = os.path.join(output_path, f'shard-{shard_index}-of-{shard_count}.jsonl')
+
+    with open(filename + '.in-progress', 'w') as output:
+        def write(entry, pmid):
+            if texts is not None:
+                entry = strip_text(entry, pmid, texts)
+            with profiling.timer('serialize'):
+                output.write(json.dumps(entry))
+                output.write('\n')
+            counts['documents'] += 1
+
+        if input_path:
+            # Add the tracks to the entries of the input file that belong to this shard, in input order.
+            seen = set()
+            with open(input_path, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    entry = json.loads(f.readline())
+                    pmid = pmid_from_source_url(entry['source_url'])
+                    if pmid not in raw_outputs:
+                        counts['without_raw_output'] += 1
+                        write(entry, pmid)
+                        continue
+                    seen.add(pmid)
+
+                    tracks = project_tracks(pmid, reader.get(pmid, *raw_outputs[pmid]), projections, counts)
+                    if not tracks:
+                        counts['empty'] += 1
+                        tracks = [{'project': projection.project, 'denotations': []} for projection in projections]
+
+                    existing = entry.get('tracks', [])
+                    if not isinstance(existing, list):
+                        existing = [existing]
+                    entry['tracks'] = [track for track in existing if track.get('project') not in project_names] + tracks
+                    write(entry, pmid)
+            counts['not_in_input'] = len(set(raw_outputs.keys()) - seen)
+        else:
+            for (pmid, source) in raw_outputs.items():
+                result = reader.get(pmid, *source)
+                text = raw_text(result)
+                if text is None:
+                    counts['without_text'] += 1
+                    continue
+
+                tracks = project_tracks(pmid, result, projections, counts)
+                if not tracks:
+                    counts['empty'] += 1
+                    continue
+
+                write({
+                    'source_db': 'PubMed',
+                    'source_url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+                    'text': text,
+                    'tracks': tracks
+                }, pmid)
+
+    os.rename(filename + '.in-progress', filename)
+    return (shard_index, counts)
+
+
+def read_rules(rules_file):
+    """ Read a JSON list of projections (see medtype_client.Projection for their settings). """
+    rules = json.load(rules_file)
+    if isinstance(rules, dict):
+        rules = [rules]
+    try:
+        projections = [Projection.from_dict(rule) for rule in rules]
+    except (RuntimeError, TypeError) as e:
+        raise click.ClickException(f"Could not read projections from {rules_file.name}: {e}")
+
+    names = [projection.project for projection in projections]
+    if len(set(names)) != len(names):
+        raise click.ClickException(f"Every projection in {rules_file.name} needs its own project name: {names}")
+    return projections
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('sources', nargs=-1, required=True, type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--output', '-O', required=True, help='Directory to write shard-I-of-N.jsonl files to', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.option('--input', 'input_file', help='PubAnnotator file to add the tracks to (otherwise only the new tracks are written)', type=click.Path(
+    file_okay=True,
+    dir_okay=False,
+    exists=True
+))
+@click.option('--project', help='Project name of the track', default=MEDTYPE_PROJECT, type=str, show_default=True)
+@click.option('--candidate-field', help='Mention field to take link_ids from', default='filtered_candidates', type=str, show_default=True)
+@click.option('--max-candidates', help='Keep at most this many candidates for each mention (0 to keep them all)', default=0, type=click.IntRange(min=0), show_default=True)
+@click.option('--min-score', help='Drop candidates scored lower than this', type=float)
+@click.option('--type', 'types', help='Only keep mentions predicted to have this type (repeat for several types)', multiple=True, type=str)
+@click.option('--exclude-type', 'exclude_types', help='Drop mentions predicted to have this type (repeat for several types)', multiple=True, type=str)
+@click.option('--drop-unlinked', is_flag=True, default=False, help='Drop mentions with no candidates left')
+@click.option('--rules', help='JSON file with a list of projections to apply instead of the options above, each adding a track', type=click.File('r'))
+@click.option('--shard-count', help='Number of output shards to split PMIDs into', default=16, type=click.IntRange(min=1), show_default=True)
+@click.option('--jobs', help='Number of shards to convert at the same time', default=os.cpu_count(), type=click.IntRange(min=1), show_default=True)
+@click.option('--overwrite', is_flag=True, default=False, help='Convert shards again even if their output already exists')
+@discovery_options
+@text_store_option
+def reproject(sources, output, input_file, project, candidate_field, max_candidates, min_score, types, exclude_types,
+              drop_unlinked, rules, shard_count, jobs, overwrite, manifest, rescan, text_store):
+    """
+    reproject.py [raw archives or directories of raw-pmid-*.json files] -O [directory to write shards to]
+    """
+    if rules:
+        projections = read_rules(rules)
+    else:
+        projections = [Projection(project, candidate_field=candidate_field, max_candidates=max_candidates,
+                                  min_score=min_score, types=types, exclude_types=exclude_types,
+                                  drop_unlinked=drop_unlinked)]
+
+    output_path = click.format_filename(output)
+    os.makedirs(output_path, exist_ok=True)
+    input_path = click.format_filename(input_file) if input_file else None
+    text_store_path = click.format_filename(text_store) if text_store else None
+
+    raw_outputs = find_raw_outputs([click.format_filename(source) for source in sources], manifest=manifest, rescan=rescan)
+    by_shard = [{} for _ in range(shard_count)]
+    for (pmid, source) in raw_outputs.items():
+        by_shard[shard_of(pmid, shard_count)][pmid] = source
+
+    offsets = input_offsets(input_path, shard_count) if input_path else [None] * shard_count
+
+    tasks = []
+    for shard_index in range(shard_count):
+        if not overwrite and os.path.exists(os.path.join(output_path, f'shard-{shard_index}-of-{shard_count}.jsonl')):
+            logging.info(f"Shard {shard_index} of {shard_count} has already been converted, skipping.")
+            continue
+        tasks.append((shard_index, shard_count, by_shard[shard_index], projections, input_path, offsets[shard_index],
+                      output_path, text_store_path))
+
+    logging.info(f"Converting {len(raw_outputs)} raw outputs in {len(tasks)} shards with "
+                 f"{len(projections)} projection(s): {[p.project for p in projections]}")
+
+    totals = dict.fromkeys(COUNTS, 0)
+    if jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+            results = pool.imap_unordered(reproject_shard, tasks)
+            for (shard_index, counts) in results:
+                logging.info(f"Shard {shard_index} of {shard_count} converted: {counts}")
+                for key in COUNTS:
+                    totals[key] += counts[key]
+    else:
+        for task in tasks:
+            (shard_index, counts) = reproject_shard(task)
+            logging.info(f"Shard {shard_index} of {shard_count} converted: {counts}")
+            for key in COUNTS:
+                totals[key] += counts[key]
+
+    profiling.count('documents', totals['documents'])
+    print(f"Wrote {totals['documents']} entries with {totals['tracks']} tracks and {totals['denotations']} denotations to {output_path}.")
+    print(f" - Raw outputs without any results: {totals['empty']}" + (" (written with empty tracks)" if input_path else ''))
+    if input_path:
+        print(f" - Raw outputs for PMIDs not in {input_path}: {totals['not_in_input']}")
+        print(f" - Entries in {input_path} without a raw output (written unchanged): {totals['without_raw_output']}")
+    else:
+        print(f" - Raw outputs without the text (use --input to add their tracks to existing entries): {totals['without_text']}")
+
+
+if __name__ == '__main__':
+    reproject()
@@ -0,0 +1,682 @@
+#!/usr/bin/env python3
+
+# A script for "scoring" PubAnnotator runs. We check for three things:
+#   - If spans roughly overlap (within a size parameter), we assume that they refer to the same span.
+#     We combine terms and categories (separately) for each span.
+#   - If a particular dataset is assumed to be definitive (--gold), we can score against that -- how many spans did
+#     each track ignore, how many were identified incorrectly, identified correctly and so on. We report precision,
+#     recall and F1 for spans, link_ids and objs, with bootstrap confidence intervals computed by resampling
+#     documents.
+#   - If no dataset is assumed to be definitive, we summarize how many spans each one identified, and what
+#     proportion of identifications agree with other tracks.
+#   - TODO: how to handle multiple concepts?
+
+import bisect
+import logging
+import json
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sqlite3
+
+import click
+
+from . import profiling
+from .discovery import balance, discovery_options, find_files
+from .pubannotator import Document, as_document
+
+logging.basicConfig(level=logging.INFO)
+
+conf_limit = 1000
+
+
+def add_denotation(denotations_by_span, project, denotation):
+    """
+    Add a Denotation to every span it overlaps with, or as a new span if it doesn't overlap any. Spans are
+    (begin, end) tuples, and are mapped to lists of (project, denotation) pairs.
+    """
+    logging.debug(f"add_denotation({project}, {denotation})")
+
+    denotation_begin = denotation.begin
+    denotation_end = denotation.end
+
+    # Look for an overlapping denotation.
+    flag_key_matched = False
+    for (key, dens) in denotations_by_span.items():
+        # We currently define overlap as having at least one character overlap.
+        if denotation_begin <= key[1] and denotation_end >= key[0]:
+            dens.append((project, denotation))
+            flag_key_matched = True
+
+    if not flag_key_matched:
+        # We couldn't find a match, so let's just add this.
+        denotations_by_span[(denotation_begin, denotation_end)] = [(project, denotation)]
+
+
+def score_projects(denotations_by_span, project1, project2):
+    """ Count how many spans are shared between two projects, and how many of those have identical link_ids and objs. """
+    shared_spans = set()
+    spans_in_1_but_not_2 = set()
+    spans_in_2_but_not_1 = set()
+
+    for span in denotations_by_span.keys():
+        dens = denotations_by_span[span]
+        den1 = [d for (project, d) in dens if project == project1]
+        den2 = [d for (project, d) in dens if project == project2]
+
+        if den1 and den2:
+            shared_spans.add(span)
+        elif den1 and not den2:
+            spans_in_1_but_not_2.add(span)
+        elif not den1 and den2:
+            spans_in_2_but_not_1.add(span)
+
+    # We can't really do any analysis where there isn't overlap, but for shared spans we can compare them.
+    count_linkid_identical = 0
+    count_obj_identical = 0
+    for span in shared_spans:
+        dens = denotations_by_span[span]
+        dens1 = [d for (project, d) in dens if project == project1]
+        dens2 = [d for (project, d) in dens if project == project2]
+
+        flag_linkid_match = False
+        flag_obj_match = False
+
+        for den1 in dens1:
+            den1_linkids = den1.link_ids
+            for linkid1 in den1_linkids:
+                if flag_linkid_match:
+                    break
+
+                for den2 in dens2:
+                    if linkid1 in den2.link_ids:
+                        flag_linkid_match = True
+                        break
+
+            den1_obj = den1.obj
+            for obj1 in den1_obj:
+                if flag_obj_match:
+                    break
+
+                for den2 in dens2:
+                    if obj1 in den2.obj:
+                        flag_obj_match = True
+                        break
+
+        if flag_linkid_match:
+            count_linkid_identical += 1
+
+        if flag_obj_match:
+            count_obj_identical += 1
+
+    return {
+        'total_spans': len(shared_spans) + len(spans_in_1_but_not_2) + len(spans_in_2_but_not_1),
+        'shared_spans': len(shared_spans),
+        'spans_in_1_but_not_2': len(spans_in_1_but_not_2),
+        'spans_in_2_but_not_1': len(spans_in_2_but_not_1),
+        'identical_link_ids': count_linkid_identical,
+        'identical_obj': count_obj_identical
+    }
+
+
+def mirror_scores(scores):
+    """ Convert the scores for (project1, project2) into the scores for (project2, project1). """
+    mirrored = dict(scores)
+    mirrored['spans_in_1_but_not_2'] = scores['spans_in_2_but_not_1']
+    mirrored['spans_in_2_but_not_1'] = scores['spans_in_1_but_not_2']
+    return mirrored
+
+
+def hash_denotations(denotations):
+    """ A content hash of a project's Denotations, so we can tell when they have changed. """
+    content = json.dumps([d.to_dict() for d in denotations], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ScoreState:
+    """
+    Scores for every document and pair of projects, stored in an SQLite database along with content hashes of
+    the two projects' denotations. A pair only needs to be rescored if either hash has changed.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pair_scores (
+            document TEXT NOT NULL,
+            project1 TEXT NOT NULL,
+            project2 TEXT NOT NULL,
+            hash1 TEXT NOT NULL,
+            hash2 TEXT NOT NULL,
+            scores TEXT NOT NULL,
+            PRIMARY KEY (document, project1, project2)
+        )""")
+        self.count_reused = 0
+        self.count_scored = 0
+
+    def scores_for_document(self, document):
+        """ Return all the stored scores for a document as {(project1, project2): (hash1, hash2, scores)}. """
+        rows = self.db.execute("SELECT project1, project2, hash1, hash2, scores FROM pair_scores WHERE document = ?", (document,))
+        return {(p1, p2): (h1, h2, json.loads(sc)) for (p1, p2, h1, h2, sc) in rows}
+
+    def score_document(self, document, denotations_by_project, project_names):
+        """
+        Score every pair of projects for a single document, reusing stored scores where the denotations haven't
+        changed. Each pair is scored using only its own two projects' denotations. Returns {project1: {project2: scores}}.
+        """
+        stored = self.scores_for_document(document)
+        hashes = {project: hash_denotations(denotations_by_project.get(project, [])) for project in project_names}
+
+        results = {}
+        for project1 in sorted(project_names):
+            for project2 in sorted(project_names):
+                # We only need to score each pair once, as the scores for (2, 1) are the mirror of those for (1, 2).
+                if project1 >= project2:
+                    continue
+
+                hash1 = hashes[project1]
+                hash2 = hashes[project2]
+                previous = stored.get((project1, project2))
+                if previous is not None and previous[0] == hash1 and previous[1] == hash2:
+                    scores = previous[2]
+                    self.count_reused += 1
+                else:
+                    denotations_by_span = {}
+                    for project in (project1, project2):
+                        for denotation in denotations_by_project.get(project, []):
+                            add_denotation(denotations_by_span, project, denotation)
+                    scores = score_projects(denotations_by_span, project1, project2)
+                    self.db.execute("INSERT OR REPLACE INTO pair_scores VALUES (?, ?, ?, ?, ?, ?)",
+                                    (document, project1, project2, hash1, hash2, json.dumps(scores)))
+                    self.count_scored += 1
+
+                results.setdefault(project1, {})[project2] = scores
+                results.setdefault(project2, {})[project1] = mirror_scores(scores)
+
+        return results
+
+    def commit(self):
+        self.db.commit()
+
+
+def add_results(results, inner_result):
+    """ Add one set of results on to another. """
+    for project1 in inner_result.keys():
+        if project1 not in results:
+            results[project1] = {}
+        for project2 in inner_result[project1].keys():
+            if project2 not in results[project1]:
+                results[project1][project2] = {}
+            for key in inner_result[project1][project2]:
+                if key not in results[project1][project2]:
+                    results[project1][project2][key] = 0
+
+                # The inner result should never cause the total to _decrease_.
+                assert(inner_result[project1][project2][key] >= 0)
+
+                results[project1][project2][key] += inner_result[project1][project2][key]
+
+
+def score_entry(entry, filter_tracks, project_names, results, state=None):
+    """
+    Score a single entry (a Document or an entry dictionary), adding its scores on to results. project_names is the
+    set of projects seen so far, which is updated with the projects in this entry. If a ScoreState is provided, pairs
+    of projects are scored incrementally using the stored scores.
+    """
+    document = as_document(entry)
+    filter_set = set(filter_tracks)
+    source_url = document.source_url
+
+    # Collect the denotations for every project.
+    selected_tracks = []
+    denotations_by_project = {}
+    for track in document.tracks:
+        project = track.project
+        if len(filter_tracks) > 0 and project not in filter_set:
+            continue
+        project_names.add(project)
+        selected_tracks.append(track)
+        denotations_by_project.setdefault(project, []).extend(track.denotations)
+
+    if state is not None:
+        add_results(results, state.score_document(source_url, denotations_by_project, project_names))
+        return
+
+    # Collect all the denotations that span the same area.
+    denotations_by_span = {}
+    with profiling.timer('overlap'):
+        for track in selected_tracks:
+            for denotation in track.denotations:
+                add_denotation(denotations_by_span, track.project, denotation)
+
+    # Some raw information if useful.
+    logging.debug("Denotations:")
+    for span in denotations_by_span.keys():
+        count = len(denotations_by_span[span])
+        if count > 1:
+            logging.debug(f" - {span} ({count} annotations):")
+            for (project, den) in denotations_by_span[span]:
+                if isinstance(den.obj, tuple) and 'biolink:NamedThing' in den.obj:
+                    logging.debug(f"  - [BIOLINK] {den.text}: {project} {den}")
+                else:
+                    logging.debug(f"  - {den.text}: {project} {den}")
+
+    # Calculate the scores
+    # 1. For every track:
+    #   1. Calculate how many denotations are shared with every other track.
+    with profiling.timer('score'):
+        for project1 in project_names:
+            for project2 in project_names:
+                # Don't compare with itself.
+                if project1 == project2:
+                    continue
+
+                add_results(results, {project1: {project2: score_projects(denotations_by_span, project1, project2)}})
+
+
+def score_file(input_path, output_file, filter_tracks, state=None):
+    """
+    Score an individual file and write it out to the given file. If a ScoreState is provided, pairs of projects
+    are scored incrementally using the stored scores.
+    """
+    project_names = set()
+    results = {}
+
+    with open(input_path, 'r') as f:
+        for line in f:
+            global conf_limit
+            conf_limit -= 1
+            if conf_limit < 0:
+                break
+            logging.debug(f"Scoring {line[:100]}")
+            profiling.count('bytes_read', len(line))
+            profiling.count('documents')
+            score_entry(Document.from_line(line), filter_tracks, project_names, results, state)
+
+    if state is not None:
+        state.commit()
+
+    # print(json.dumps(results, sort_keys=True, indent=4))
+    return results
+
+
+def print_results(results, count_files):
+    """ Print a summary of the scores for every pair of projects. """
+    print(f"Counted results from {count_files} files.")
+    for project1 in results.keys():
+        print(f" - Project 1: {project1}")
+        for project2 in results[project1].keys():
+            print(f"   - Project 2: {project2}")
+
+            inner_result = results[project1][project2]
+
+            print("     - Total spans across both projects: {}".format(inner_result['total_spans']))
+            print("     - Spans in project 1 but not in project 2: {} ({:.2%})".format(inner_result['spans_in_1_but_not_2'], float(inner_result['spans_in_1_but_not_2'])/inner_result['total_spans']))
+            print("     - Spans in project 2 but not in project 1: {} ({:.2%})".format(inner_result['spans_in_2_but_not_1'], float(inner_result['spans_in_2_but_not_1'])/inner_result['total_spans']))
+            print("     - Shared spans: {} ({:.2%}), of which:".format(inner_result['shared_spans'], float(inner_result['shared_spans'])/inner_result['total_spans']))
+            print("       - Identical link_ids (item) matches: {} ({:.2%})".format(inner_result['identical_link_ids'], float(inner_result['identical_link_ids'])/inner_result['shared_spans']))
+            print("       - Identical obj (category) matches: {} ({:.2%})".format(inner_result['identical_obj'], float(inner_result['identical_obj'])/inner_result['shared_spans']))
+
+
+# The counts we collect for every tool in every document when scoring against a gold track. A predicted
+# denotation is correct if it overlaps a gold denotation (sharing a link_id or obj, for those levels), and a gold
+# denotation is found if it overlaps a predicted denotation in the same way.
+GOLD_LEVELS = ['span', 'link_ids', 'obj']
+GOLD_COUNTS = ['predicted', 'gold'] + [f'{level}_{kind}' for level in GOLD_LEVELS for kind in ('correct', 'found')]
+
+# numpy is only imported by the functions that need it in --gold mode, so that other runs start faster.
+
+# How many (replicate x document) weights to generate at once while bootstrapping, to limit memory use.
+BOOTSTRAP_BATCH_CELLS = 20_000_000
+
+
+def as_list(value):
+    """ link_ids and objs may be a single string or a list of strings. """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return value
+    return list(value)
+
+
+@profiling.timed('overlap')
+def match_denotations(denotations, others):
+    """
+    For every denotation, check whether it overlaps any of the other denotations, and whether any of those
+    overlapping denotations share a link_id or an obj with it. Returns a list of (span, link_ids, obj) booleans.
+
+    Both lists are swept in order of their beginnings: the other denotations before `start` all end before the
+    current denotation begins (max_ends[i] is the largest end among the first i + 1), so they can't overlap it or
+    any later one.
+    """
+    others = sorted(
+        ((o.begin, o.end, set(as_list(o.link_ids)), set(as_list(o.obj))) for o in others),
+        key=lambda o: o[0]
+    )
+    others_begins = [o[0] for o in others]
+    max_ends = list(itertools.accumulate((o[1] for o in others), max))
+
+    matches = [None] * len(denotations)
+    start = 0
+    for index in sorted(range(len(denotations)), key=lambda i: denotations[i].begin):
+        d = denotations[index]
+        begin = d.begin
+        end = d.end
+        link_ids = set(as_list(d.link_ids))
+        obj = set(as_list(d.obj))
+
+        while start < len(others) and max_ends[start] < begin:
+            start += 1
+
+        # We use the same definition of overlap as add_denotation(): at least one character in common.
+        stop = bisect.bisect_right(others_begins, end, lo=start)
+        overlapping = [o for o in itertools.islice(others, start, stop) if o[1] >= begin]
+        matches[index] = (
+            len(overlapping) > 0,
+            any(link_ids & o[2] for o in overlapping),
+            any(obj & o[3] for o in overlapping)
+        )
+
+    return matches
+
+
+def gold_counts_entry(entry, gold, filter_set):
+    """
+    Score every track in an entry (a Document or an entry dictionary) against the gold track. Returns {project: (counts, counts_by_gold_type,
+    counts_by_predicted_type)}, where counts follows GOLD_COUNTS and the per-type counts are
+    [denotations, span, link_ids, obj], or None if the entry doesn't have a gold track. The gold project itself
+    is scored as a track with no denotations, which is what counts for the tools that have no track in this entry.
+    """
+    denotations_by_project = {}
+    for track in as_document(entry).tracks:
+        project = track.project
+        if project != gold and len(filter_set) > 0 and project not in filter_set:
+            continue
+        denotations_by_project.setdefault(project, []).extend(track.denotations)
+
+    if gold not in denotations_by_project:
+        return None
+    gold_denotations = denotations_by_project.pop(gold)
+    denotations_by_project[gold] = []
+
+    results = {}
+    for project, denotations in denotations_by_project.items():
+        counts = [len(denotations), len(gold_denotations)] + [0] * (len(GOLD_COUNTS) - 2)
+        by_gold_type = {}
+        by_predicted_type = {}
+
+        for (denotation, matched) in zip(denotations, match_denotations(denotations, gold_denotations)):
+            for (index, level) in enumerate(GOLD_LEVELS):
+                counts[GOLD_COUNTS.index(f'{level}_correct')] += matched[index]
+            for obj in as_list(denotation.obj):
+                type_counts = by_predicted_type.setdefault(obj, [0, 0, 0, 0])
+                type_counts[0] += 1
+                for index in range(len(GOLD_LEVELS)):
+                    type_counts[index + 1] += matched[index]
+
+        for (denotation, matched) in zip(gold_denotations, match_denotations(gold_denotations, denotations)):
+            for (index, level) in enumerate(GOLD_LEVELS):
+                counts[GOLD_COUNTS.index(f'{level}_found')] += matched[index]
+            for obj in as_list(denotation.obj):
+                type_counts = by_gold_type.setdefault(obj, [0, 0, 0, 0])
+                type_counts[0] += 1
+                for index in range(len(GOLD_LEVELS)):
+                    type_counts[index + 1] += matched[index]
+
+        results[project] = (counts, by_gold_type, by_predicted_type)
+
+    return results
+
+
+def gold_counts_file(input_path, gold, filter_tracks):
+    """ Score every entry in a file against the gold track. Returns a list of gold_counts_entry() results. """
+    filter_set = set(filter_tracks)
+    documents = []
+    with open(input_path, 'r') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            profiling.count('bytes_read', len(line))
+            profiling.count('documents')
+            result = gold_counts_entry(Document.from_line(line), gold, filter_set)
+            if result is None:
+                logging.debug(f"No gold track '{gold}' found in {line[:100]}, skipping.")
+                continue
+            documents.append(result)
+    return documents
+
+
+def _gold_counts_files(args):
+    """ Score a group of files against the gold track in a worker process, returning their results by filename. """
+    (filenames, gold, filter_tracks) = args
+    return {filename: gold_counts_file(filename, gold, filter_tracks) for filename in filenames}
+
+
+def gold_metrics(totals):
+    """
+    Calculate precision, recall and F1 for every level from an array of totals whose last axis follows
+    GOLD_COUNTS. Returns {level: (precision, recall, f1)}, each an array of the remaining shape.
+    """
+    import numpy
+
+    metrics = {}
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for level in GOLD_LEVELS:
+            precision = totals[..., GOLD_COUNTS.index(f'{level}_correct')] / totals[..., GOLD_COUNTS.index('predicted')]
+            recall = totals[..., GOLD_COUNTS.index(f'{level}_found')] / totals[..., GOLD_COUNTS.index('gold')]
+            # F1 is 0 (rather than 0/0) when nothing was correct.
+            f1 = numpy.where(precision + recall == 0, 0.0, 2 * precision * recall / (precision + recall))
+            metrics[level] = (precision, recall, f1)
+    return metrics
+
+
+_bootstrap_counts = None
+
+
+def _init_bootstrap(counts):
+    global _bootstrap_counts
+    _bootstrap_counts = counts
+
+
+def _bootstrap_totals(args):
+    """
+    Resample documents with replacement `replicates` times, returning the total counts for each replicate. Each
+    replicate is a vector of how often each document was drawn, so the totals are a single matrix product.
+    """
+    import numpy
+
+    replicates, seed = args
+    counts = _bootstrap_counts
+    docs = counts.shape[0]
+    rng = numpy.random.default_rng(seed)
+
+    batch_size = max(1, BOOTSTRAP_BATCH_CELLS // docs)
+    totals = []
+    for start in range(0, replicates, batch_size):
+        weights = rng.multinomial(docs, numpy.full(docs, 1.0 / docs), size=min(batch_size, replicates - start))
+        totals.append(weights.astype(numpy.float64) @ counts)
+    return numpy.concatenate(totals)
+
+
+@profiling.timed('bootstrap')
+def bootstrap_intervals(counts, replicates, confidence, jobs, seed):
+    """
+    Calculate bootstrap confidence intervals for gold_metrics() from per-document counts (an array of shape
+    documents x tools x GOLD_COUNTS), spreading the replicates over `jobs` processes.
+    Returns {level: ((precision_low, precision_high), (recall_low, recall_high), (f1_low, f1_high))}, each an
+    array with one value per tool.
+    """
+    import numpy
+
+    docs, tools, fields = counts.shape
+    flat = counts.reshape(docs, tools * fields).astype(numpy.float64)
+
+    jobs = max(1, min(jobs, replicates))
+    seeds = numpy.random.SeedSequence(seed).spawn(jobs)
+    tasks = [(replicates // jobs + (1 if index < replicates % jobs else 0), seeds[index]) for index in range(jobs)]
+
+    if jobs == 1:
+        _init_bootstrap(flat)
+        totals = _bootstrap_totals(tasks[0])
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_bootstrap, initargs=(flat,)) as pool:
+            totals = numpy.concatenate(pool.map(_bootstrap_totals, tasks))
+
+    metrics = gold_metrics(totals.reshape(replicates, tools, fields))
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for level, values in metrics.items():
+        intervals[level] = tuple(
+            tuple(numpy.nanquantile(value, [alpha, 1 - alpha], axis=0))
+            for value in values
+        )
+    return intervals
+
+
+def print_gold_report(gold, documents, replicates, confidence, jobs, seed, types_shown):
+    """ Summarize and print the results of scoring every document against the gold track. """
+    import numpy
+
+    projects = sorted(set(project for document in documents for project in document.keys()) - {gold})
+    print(f"Scored {len(documents)} documents against gold track {gold}.")
+    if not projects:
+        return
+
+    counts = numpy.zeros((len(documents), len(projects), len(GOLD_COUNTS)), dtype=numpy.int64)
+    by_gold_type = {project: {} for project in projects}
+    by_predicted_type = {project: {} for project in projects}
+    for (index, document) in enumerate(documents):
+        for (tool, project) in enumerate(projects):
+            # A tool without a track in this document found none of its gold denotations.
+            if project in document:
+                (doc_counts, doc_by_gold_type, doc_by_predicted_type) = document[project]
+            elif gold in document:
+                (doc_counts, doc_by_gold_type, doc_by_predicted_type) = document[gold]
+            else:
+                continue
+            counts[index, tool] = doc_counts
+            for (types, doc_types) in ((by_gold_type[project], doc_by_gold_type), (by_predicted_type[project], doc_by_predicted_type)):
+                for (obj, type_counts) in doc_types.items():
+                    types[obj] = [a + b for (a, b) in zip(types.get(obj, [0, 0, 0, 0]), type_counts)]
+
+    metrics = gold_metrics(counts.sum(axis=0).astype(numpy.float64))
+    intervals = bootstrap_intervals(counts, replicates, confidence, jobs, seed) if replicates > 0 and len(documents) > 0 else None
+
+    def format_metric(level, metric, tool):
+        value = metrics[level][metric][tool]
+        if intervals is None:
+            return f"{value:.2%}"
+        (low, high) = intervals[level][metric]
+        return f"{value:.2%} [{low[tool]:.2%}, {high[tool]:.2%}]"
+
+    def format_ratio(numerator, denominator):
+        return f"{float(numerator)/denominator:.2%}" if denominator else "n/a"
+
+    if intervals is not None:
+        print(f"(Bracketed ranges are {confidence:.0%} bootstrap confidence intervals from {replicates} replicates.)")
+
+    for (tool, project) in enumerate(projects):
+        totals = counts[:, tool].sum(axis=0)
+        print(f" - Project: {project} ({totals[GOLD_COUNTS.index('predicted')]} denotations, {totals[GOLD_COUNTS.index('gold')]} gold denotations)")
+        for level in GOLD_LEVELS:
+            print(f"   - {level}: precision {format_metric(level, 0, tool)}, recall {format_metric(level, 1, tool)}, F1 {format_metric(level, 2, tool)}")
+
+        print("   - Recall by gold type:")
+        for (obj, type_counts) in sorted(by_gold_type[project].items(), key=lambda t: -t[1][0])[:types_shown]:
+            recalls = ', '.join(f"{level} {format_ratio(type_counts[index + 1], type_counts[0])}" for (index, level) in enumerate(GOLD_LEVELS))
+            print(f"     - {obj} ({type_counts[0]} gold denotations): {recalls}")
+
+        print("   - Precision by predicted type:")
+        for (obj, type_counts) in sorted(by_predicted_type[project].items(), key=lambda t: -t[1][0])[:types_shown]:
+            precisions = ', '.join(f"{level} {format_ratio(type_counts[index + 1], type_counts[0])}" for (index, level) in enumerate(GOLD_LEVELS))
+            print(f"     - {obj} ({type_counts[0]} denotations): {precisions}")
+
+
+def gold_report_options(f):
+    """ Add the --confidence, --seed and --types-shown options for print_gold_report() to a click command. """
+    f = click.option('--types-shown', help='Number of types to show in the per-type breakdown in --gold mode', default=20, type=int, show_default=True)(f)
+    f = click.option('--seed', help='Random seed for bootstrapping', default=0, type=int, show_default=True)(f)
+    f = click.option('--confidence', help='Confidence level for bootstrap confidence intervals', default=0.95, type=click.FloatRange(0, 1, min_open=True, max_open=True), show_default=True)(f)
+    return f
+
+
+@click.command()
+@profiling.profile_option
+@click.argument('input', type=click.Path(
+    file_okay=True,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--output', '-O', default='-', type=click.File('w'))
+@click.option('--filter', '-f', help='List of projects whose tracks should be included (all other tracks are filtered out)', multiple=True)
+@click.option('--state', help='SQLite database of per-document scores for every pair of projects; only pairs whose tracks have changed '
+                              'are rescored. Each pair is scored using only its own two tracks.', type=click.Path(
+    file_okay=True,
+    dir_okay=False
+))
+@click.option('--gold', help='Score every other track against this track (e.g. PubMedDS), reporting precision, recall and F1', type=str)
+@click.option('--bootstrap', help='Number of bootstrap replicates used to calculate confidence intervals in --gold mode (0 to disable)', default=1000, type=click.IntRange(min=0), show_default=True)
+@click.option('--jobs', help='Number of processes to spread bootstrap replicates over', default=os.cpu_count(), type=click.IntRange(min=1), show_default=True)
+@gold_report_options
+@discovery_options
+def score(input, output, filter, state, gold, bootstrap, confidence, jobs, seed, types_shown, manifest, rescan):
+    """
+    score.py [PubAnnotator JSONL file or directory to annotate]
+    """
+    input_path = click.format_filename(input)
+
+    if gold:
+        documents = []
+        if os.path.isdir(input_path):
+            input_files = find_files(input_path, manifest=manifest, rescan=rescan)
+
+            # Count files in parallel, in groups of similar total size, but keep documents in file order so that
+            # bootstrap replicates don't depend on which process finished first.
+            documents_by_file = {}
+            groups = [([input_file.path for input_file in group], gold, filter) for group in balance(input_files, min(jobs, max(len(input_files), 1)))]
+            if len(groups) > 1:
+                with multiprocessing.Pool(len(groups)) as pool:
+                    for result in pool.imap_unordered(_gold_counts_files, groups):
+                        documents_by_file.update(result)
+            else:
+                for group in groups:
+                    documents_by_file.update(_gold_counts_files(group))
+
+            for input_file in input_files:
+                documents.extend(documents_by_file[input_file.path])
+        else:
+            documents = gold_counts_file(input_path, gold, filter)
+
+        print_gold_report(gold, documents, bootstrap, confidence, jobs, seed, types_shown)
+        return
+
+    score_state = ScoreState(click.format_filename(state)) if state else None
+
+    count_files = 0
+    if os.path.isdir(input_path):
+        results = {}
+        for input_file in find_files(input_path, manifest=manifest, rescan=rescan):
+            filename = input_file.path
+            count_files += 1
+            inner_result = score_file(filename, output, filter, score_state)
+
+            # Add this on to the results object.
+            add_results(results, inner_result)
+
+            # All of these numbers should be going up over time.
+            logging.debug(f"Processing {filename}, results at: {json.dumps(results, indent=2, sort_keys=True)}")
+
+    else:
+        results = score_file(input_path, output, filter, score_state)
+        count_files = 1
+
+    if score_state is not None:
+        logging.info(f"Scored {score_state.count_scored} document/project pairs, reused {score_state.count_reused} stored scores.")
+
+    print_results(results, count_files)
+
+
+if __name__ == '__main__':
+    score()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Deterministic work sharding, so that query_medtype.py and nodenorm.py can be run as N independent jobs over
+# the same input without coordinating with each other.
+#
+# Every entry is assigned to a shard by a stable hash of its PMID. When run with --shard-index I --shard-count N,
+# a script skips every entry that doesn't belong to shard I (reading the PMID out of the raw line where possible,
+# so skipped entries never need to be parsed) and writes its outputs into <output>/shard-I-of-N/. That directory
+# also contains a ledger of the PMIDs the shard has completed, and a done.json file once the shard has finished.
+# This script can then verify that every shard has finished and consolidate their outputs.
+
+import logging
+import json
+import glob
+import hashlib
+import os
+import re
+import threading
+
+import click
+
+from .raw_archive import INDEX_FILENAME, RawArchive
+
+logging.basicConfig(level=logging.INFO)
+
+LEDGER_FILENAME = 'ledger.txt'
+DONE_FILENAME = 'done.json'
+
+# Find the PMID in a PubAnnotator line without parsing the whole line.
+SOURCE_URL_PMID = re.compile('"source_url"\\s*:\\s*"https://pubmed\\.ncbi\\.nlm\\.nih\\.gov/([^"/]+)/?"')
+
+# Find the PMID in the name of a per-PMID output file (e.g. pmid-123.jsonl or pmid_123.jsonl).
+FILENAME_PMID = re.compile('^pmid[-_](\\d+)\\.jsonl$')
+
+
+def shard_of(pmid, shard_count):
+    """ The shard that a PMID belongs to. This must never change, or shards from different runs won't line up. """
+    digest = hashlib.md5(str(pmid).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def owns_line(line, shard_index, shard_count):
+    """
+    Does this PubAnnotator line belong to this shard? Returns None if we couldn't find a PMID in the line, in
+    which case the caller will need to parse the line to find out.
+    """
+    m = SOURCE_URL_PMID.search(line)
+    if not m:
+        return None
+    return shard_of(m.group(1), shard_count) == shard_index
+
+
+def shard_path(output_path, shard_index, shard_count):
+    return os.path.join(output_path, f'shard-{shard_index}-of-{shard_count}')
+
+
+def shard_options(f):
+    """ Add the --shard-index and --shard-count options to a click command. """
+    f = click.option('--shard-count', help='Split the input into this many shards by PMID', default=1, type=click.IntRange(min=1), show_default=True)(f)
+    f = click.option('--shard-index', help='The shard to process (from 0 to shard count - 1)', default=0, type=click.IntRange(min=0), show_default=True)(f)
+    return f
+
+
+def check_shard_options(shard_index, shard_count):
+    if shard_index >= shard_count:
+        raise click.BadParameter(f"Shard index {shard_index} must be less than the shard count {shard_count}", param_hint='--shard-index')
+
+
+class ShardLedger:
+    """
+    The progress ledger for a single shard: a list of completed PMIDs, and a done.json file with final counts
+    once the shard has finished.
+    """
+
+    def __init__(self, output_path, shard_index, shard_count):
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.path = shard_path(output_path, shard_index, shard_count)
+        os.makedirs(self.path, exist_ok=True)
+
+        self.ledger_path = os.path.join(self.path, LEDGER_FILENAME)
+        self.done_path = os.path.join(self.path, DONE_FILENAME)
+        self.lock = threading.Lock()
+
+        # If we're (re)starting this shard, it isn't done any more.
+        if os.path.exists(self.done_path):
+            os.remove(self.done_path)
+
+    def owns(self, pmid):
+        return shard_of(pmid, self.shard_count) == self.shard_index
+
+    def owns_line(self, line):
+        return owns_line(line, self.shard_index, self.shard_count)
+
+    def record(self, pmid):
+        """ Record that a PMID has been completed. """
+        with self.lock:
+            with open(self.ledger_path, 'a') as f:
+                f.write(f'{pmid}\n')
+
+    def finish(self, **counts):
+        """ Mark this shard as finished. """
+        with open(self.done_path + '.in-progress', 'w') as f:
+            json.dump({
+                'shard_index': self.shard_index,
+                'shard_count': self.shard_count,
+                'counts': counts
+            }, f, sort_keys=True, indent=4)
+        os.rename(self.done_path + '.in-progress', self.done_path)
+        logging.info(f"Shard {self.shard_index} of {self.shard_count} finished: {counts}")
+
+
+def read_ledger(path):
+    ledger_path = os.path.join(path, LEDGER_FILENAME)
+    if not os.path.exists(ledger_path):
+        return []
+    with open(ledger_path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@click.group()
+def sharding():
+    """
+    sharding.py [command] -- check and consolidate the outputs of sharded runs.
+    """
+    pass
+
+
+@sharding.command()
+@click.argument('output', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--shard-count', help='Number of shards the run was split into', required=True, type=click.IntRange(min=1))
+def verify(output, shard_count):
+    """
+    Check that every shard of a run has finished.
+    """
+    output_path = click.format_filename(output)
+
+    unfinished = []
+    totals = {}
+    for shard_index in range(shard_count):
+        path = shard_path(output_path, shard_index, shard_count)
+        done_path = os.path.join(path, DONE_FILENAME)
+        if not os.path.exists(done_path):
+            logging.error(f"Shard {shard_index} has not finished ({len(read_ledger(path))} PMIDs completed so far).")
+            unfinished.append(shard_index)
+            continue
+
+        with open(done_path, 'r') as f:
+            done = json.load(f)
+        for key, value in done['counts'].items():
+            totals[key] = totals.get(key, 0) + value
+
+    print(f"{shard_count - len(unfinished)} of {shard_count} shards finished.")
+    for key in sorted(totals.keys()):
+        print(f" - {key}: {totals[key]}")
+
+    if unfinished:
+        raise click.ClickException(f"Unfinished shards: {unfinished}")
+
+
+@sharding.command()
+@click.argument('output', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--shard-count', help='Number of shards the run was split into', required=True, type=click.IntRange(min=1))
+@click.option('--consolidated', '-O', default='-', type=click.File('w'), help='JSONL file to write the PubAnnotator outputs of every shard to')
+@click.option('--archive', help='Consolidate the raw MedType archives in ARCHIVE/shard-*-of-N into ARCHIVE (or ARCHIVE/<linker> for each entity linker)', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.option('--force', is_flag=True, default=False, help='Consolidate outputs even if some shards have not finished')
+def consolidate(output, shard_count, consolidated, archive, force):
+    """
+    Combine the per-PMID outputs of every shard into a single JSONL file.
+    """
+    output_path = click.format_filename(output)
+
+    for shard_index in range(shard_count):
+        if not os.path.exists(os.path.join(shard_path(output_path, shard_index, shard_count), DONE_FILENAME)) and not force:
+            raise click.ClickException(f"Shard {shard_index} has not finished; run `sharding.py verify` for details, or use --force.")
+
+    count_entries = 0
+    for shard_index in range(shard_count):
+        path = shard_path(output_path, shard_index, shard_count)
+        for filename in sorted(glob.iglob(os.path.join(path, 'pmid*.jsonl'))):
+            with open(filename, 'r') as f:
+                for line in f:
+                    if line.strip() == '':
+                        continue
+                    consolidated.write(line.rstrip('\n'))
+                    consolidated.write('\n')
+                    count_entries += 1
+
+    logging.info(f"Consolidated {count_entries} entries from {shard_count} shards.")
+
+    if archive:
+        consolidate_archives(click.format_filename(archive), shard_count, force)
+
+
+def shard_archives(path):
+    """
+    The raw archives in one shard's archive directory, as a dictionary of name -> path. A run with a single entity
+    linker keeps its archive in the directory itself (name ''), a run with several keeps one in a subdirectory
+    for each linker (named after the linker).
+    """
+    if os.path.exists(os.path.join(path, INDEX_FILENAME)):
+        return {'': path}
+    return {name: os.path.join(path, name) for name in sorted(os.listdir(path))
+            if os.path.exists(os.path.join(path, name, INDEX_FILENAME))}
+
+
+def consolidate_archives(archive_path, shard_count, force=False):
+    """ Merge the raw archives in ARCHIVE/shard-I-of-N (or ARCHIVE/shard-I-of-N/<linker>) into ARCHIVE(/<linker>). """
+    combined = {}
+    for shard_index in range(shard_count):
+        path = shard_path(archive_path, shard_index, shard_count)
+        if not os.path.exists(path):
+            logging.warning(f"No raw archive found for shard {shard_index} at {path}")
+            continue
+
+        archives = shard_archives(path)
+        if not archives:
+            message = f"Shard {shard_index} has an archive directory at {path}, but no {INDEX_FILENAME} in it or its subdirectories"
+            if not force:
+                raise click.ClickException(message + "; use --force to consolidate the other shards anyway.")
+            logging.warning(message)
+            continue
+
+        for (name, path) in archives.items():
+            if name not in combined:
+                combined[name] = RawArchive(os.path.join(archive_path, name) if name else archive_path)
+            for pmid, response in RawArchive(path).items():
+                if pmid not in combined[name]:
+                    combined[name].put(pmid, response)
+
+    for (name, archive) in combined.items():
+        logging.info(f"Consolidated raw archives into {archive.path} ({len(archive)} responses).")
+
+
+if __name__ == '__main__':
+    sharding()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Deduplicated storage for abstract texts.
+#
+# Abstracts are usually the largest part of a PubAnnotator entry, but most of our scripts never look at them:
+# nodenorm.py and combine.py only pass them along, and score.py only needs spans. Given --text-store, the scripts
+# that write entries store every text once in a content-addressed text store and write annotation-only entries,
+# where the text is replaced by a reference to the store:
+#
+#   {"source_url": "https://pubmed.ncbi.nlm.nih.gov/123/", "text_ref": {"pmid": "123", "sha256": "..."}, "tracks": [...]}
+#
+# Scripts that don't need the text pass these references along untouched, and entry_text() only loads the text
+# from the store when it is actually needed. `text_store.py inflate` turns annotation-only entries back into
+# ordinary PubAnnotator entries.
+
+import logging
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import click
+
+logging.basicConfig(level=logging.INFO)
+
+
+def text_store_option(f):
+    """ Add the --text-store option to a click command that writes PubAnnotator entries. """
+    return click.option('--text-store', help='Store texts in this text store and write annotation-only entries that refer to them', type=click.Path(
+        file_okay=False,
+        dir_okay=True
+    ))(f)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class TextStore:
+    """
+    A directory of texts stored as <store>/<first two characters of hash>/<SHA-256 of text>.txt.gz. Since texts
+    are stored under their own hash, a text is only ever stored once, however many entries or runs refer to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.path, sha256[:2], sha256 + '.txt.gz')
+
+    def __contains__(self, sha256):
+        return os.path.exists(self._path(sha256))
+
+    def put(self, text):
+        """ Store a text (unless it's already stored), returning its hash. """
+        sha256 = text_hash(text)
+        path = self._path(sha256)
+        if os.path.exists(path):
+            return sha256
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        in_progress = f'{path}.{os.getpid()}.{threading.get_ident()}.in-progress'
+        with gzip.open(in_progress, 'wt', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(in_progress, path)
+        return sha256
+
+    def get(self, sha256):
+        path = self._path(sha256)
+        if not os.path.exists(path):
+            raise RuntimeError(f"Text {sha256} not found in text store {self.path}")
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return f.read()
+
+
+def strip_text(entry, pmid, store):
+    """ Store the text of an entry, returning an annotation-only copy of the entry that refers to it. """
+    if 'text' not in entry:
+        return entry
+
+    stripped = {}
+    for (key, value) in entry.items():
+        if key == 'text':
+            stripped['text_ref'] = {'pmid': pmid, 'sha256': store.put(value)}
+        else:
+            stripped[key] = value
+    return stripped
+
+
+def entry_text(entry, store=None):
+    """ The text of an entry, loading it from the text store if this is an annotation-only entry. """
+    if 'text' in entry:
+        return entry['text']
+    if 'text_ref' not in entry:
+        raise RuntimeError(f"Entry {entry.get('source_url')} has neither text nor text_ref")
+    if store is None:
+        raise RuntimeError(f"Entry {entry.get('source_url')} is annotation-only; a text store is needed to read its text")
+    return store.get(entry['text_ref']['sha256'])
+
+
+def inflate_entry(entry, store):
+    """ Replace the text_ref in an annotation-only entry with the text it refers to. """
+    if 'text_ref' not in entry:
+        return entry
+
+    inflated = {}
+    for (key, value) in entry.items():
+        if key == 'text_ref':
+            inflated['text'] = store.get(value['sha256'])
+        else:
+            inflated[key] = value
+    return inflated
+
+
+@click.group()
+def text_store():
+    """
+    text_store.py [command] -- convert between ordinary and annotation-only PubAnnotator files.
+    """
+    pass
+
+
+@text_store.command()
+@click.argument('store', type=click.Path(
+    file_okay=False,
+    dir_okay=True
+))
+@click.argument('input', default='-', type=click.File('r'))
+@click.option('--output', '-O', default='-', type=click.File('w'), help='Annotation-only JSONL file to write')
+def strip(store, input, output):
+    """
+    Move the texts of a PubAnnotator file into a text store, writing annotation-only entries.
+    """
+    texts = TextStore(click.format_filename(store))
+
+    count_entries = 0
+    for line in input:
+        if line.strip() == '':
+            continue
+        entry = json.loads(line)
+        source_url = entry['source_url']
+        pmid = source_url[32:].rstrip('/') if source_url.startswith('https://pubmed.ncbi.nlm.nih.gov/') else source_url
+        json.dump(strip_text(entry, pmid, texts), output)
+        output.write('\n')
+        count_entries += 1
+
+    logging.info(f"Stripped texts from {count_entries} entries into {texts.path}.")
+
+
+@text_store.command()
+@click.argument('store', type=click.Path(
+    file_okay=False,
+    dir_okay=True,
+    exists=True
+))
+@click.argument('input', default='-', type=click.File('r'))
+@click.option('--output', '-O', default='-', type=click.File('w'), help='PubAnnotator JSONL file to write')
+def inflate(store, input, output):
+    """
+    Add the texts from a text store back into annotation-only entries.
+    """
+    texts = TextStore(click.format_filename(store))
+
+    for line in input:
+        if line.strip() == '':
+            continue
+        json.dump(inflate_entry(json.loads(line), texts), output)
+        output.write('\n')
+
+
+if __name__ == '__main__':
+    text_store()
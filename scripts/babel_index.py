@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/babel_index.py, and can now be run as `medtype-benchmarks babel-index`.
+# This wrapper keeps `python scripts/babel_index.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.babel_index import babel_index
+
+if __name__ == '__main__':
+    babel_index()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/discovery.py, and can now be run as `medtype-benchmarks discovery`.
+# This wrapper keeps `python scripts/discovery.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.discovery import discovery
+
+if __name__ == '__main__':
+    discovery()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/medtype_cache.py, and can now be run as `medtype-benchmarks cache`.
+# This wrapper keeps `python scripts/medtype_cache.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.medtype_cache import medtype_cache
+
+if __name__ == '__main__':
+    medtype_cache()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/pipeline.py, and can now be run as `medtype-benchmarks pipeline`.
+# This wrapper keeps `python scripts/pipeline.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.pipeline import pipeline
+
+if __name__ == '__main__':
+    pipeline()
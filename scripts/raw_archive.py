@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/raw_archive.py, and can now be run as `medtype-benchmarks raw-archive`.
+# This wrapper keeps `python scripts/raw_archive.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.raw_archive import raw_archive
+
+if __name__ == '__main__':
+    raw_archive()
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+
+# This wrapper runs medtype_benchmarks/reproject.py (`medtype-benchmarks reproject`) without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.reproject import reproject
+
+if __name__ == '__main__':
+    reproject()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/sharding.py, and can now be run as `medtype-benchmarks sharding`.
+# This wrapper keeps `python scripts/sharding.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.sharding import sharding
+
+if __name__ == '__main__':
+    sharding()
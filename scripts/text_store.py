@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# This script has moved to medtype_benchmarks/text_store.py, and can now be run as `medtype-benchmarks text-store`.
+# This wrapper keeps `python scripts/text_store.py` working without installing the package.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from medtype_benchmarks.text_store import text_store
+
+if __name__ == '__main__':
+    text_store()